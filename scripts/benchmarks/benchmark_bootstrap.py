@@ -0,0 +1,47 @@
+import os
+import sys
+import time
+import numpy as np
+
+# Ensure the root directory is in the sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scripts.decentralization.calculate_metrics import BOOTSTRAPPED_METRICS, bootstrap_metric_intervals, calculate_token_metrics
+
+# Benchmark the batched bootstrap against resampling and recomputing the metrics in a Python loop.
+# Measured on one core: about 5s against 8s for the loop, i.e. 1.6-1.8x, and 0.9-1.9x for
+# snapshots of 1k-100k holders. Both are bound by drawing n indices per replicate; the batched
+# version also pays for counting them and a row-wise cumsum, so a larger speedup is not expected.
+HOLDERS = 300000
+REPLICATES = 1000
+LOOP_REPLICATES = 50  # The loop is timed on fewer replicates and scaled up
+
+def bootstrap_loop(amounts, replicates, rng):
+    estimates = {metric: [] for metric in BOOTSTRAPPED_METRICS}
+    for _ in range(replicates):
+        metrics = calculate_token_metrics(rng.choice(amounts, size=len(amounts), replace=True))
+        for metric in BOOTSTRAPPED_METRICS:
+            estimates[metric].append(metrics[metric])
+    return {metric: np.array(values) for metric, values in estimates.items()}
+
+def main():
+    rng = np.random.default_rng(42)
+    amounts = rng.pareto(1.1, HOLDERS) * 100
+
+    start = time.perf_counter()
+    bootstrap_loop(amounts, LOOP_REPLICATES, rng)
+    loop_time = (time.perf_counter() - start) * REPLICATES / LOOP_REPLICATES
+
+    start = time.perf_counter()
+    intervals = bootstrap_metric_intervals(amounts, REPLICATES)
+    batched_time = time.perf_counter() - start
+
+    point = calculate_token_metrics(amounts)
+    print(f"{REPLICATES} bootstrap replicates of a snapshot with {HOLDERS} holders:")
+    print(f"  Python loop (extrapolated): {loop_time:.1f}s")
+    print(f"  Batched weights:            {batched_time:.1f}s ({loop_time / batched_time:.1f}x)")
+    for metric in BOOTSTRAPPED_METRICS:
+        print(f"  {metric}: {point[metric]:.4f} [{intervals[f'{metric}_ci_low']:.4f}, {intervals[f'{metric}_ci_high']:.4f}]")
+
+if __name__ == "__main__":
+    main()
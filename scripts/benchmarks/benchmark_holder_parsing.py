@@ -0,0 +1,53 @@
+import os
+import sys
+import time
+import tempfile
+import numpy as np
+import pandas as pd
+
+# Ensure the root directory is in the sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scripts.decentralization.process_token_holders import parse_raw_holder_csv, parse_raw_holder_csv_rows
+from scripts.decentralization.holder_store import bytes_to_addresses
+
+# Benchmark the bulk raw CSV parser against the original per-row json.loads implementation
+ROWS = 500000
+REPEATS = 3
+
+def write_synthetic_snapshot(file_path, rows):
+    rng = np.random.default_rng(42)
+    addresses = bytes_to_addresses(np.frombuffer(rng.bytes(20 * rows), dtype='S20')).tolist()
+    amounts = np.sort(rng.pareto(1.2, rows) * 100)[::-1].tolist()
+    df = pd.DataFrame({
+        'Holder': [str({'Address': address}) for address in addresses],
+        'Balance': [str({'Amount': f"{amount:.18f}"}) for amount in amounts]
+    })
+    df.to_csv(file_path, index=False)
+
+def best_time(function, *args):
+    timings = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        result = function(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_path = os.path.join(tmp_dir, "synthetic.csv")
+        print(f"Writing synthetic snapshot with {ROWS} rows...")
+        write_synthetic_snapshot(file_path, ROWS)
+
+        baseline_time, (baseline_address, baseline_balance) = best_time(parse_raw_holder_csv_rows, file_path)
+        bulk_time, (address, balance) = best_time(parse_raw_holder_csv, file_path)
+
+        assert np.array_equal(address, baseline_address)
+        assert np.array_equal(balance, baseline_balance)
+
+        print(f"json.loads per row: {baseline_time:.3f}s")
+        print(f"Bulk regex parser:  {bulk_time:.3f}s")
+        print(f"Speedup: {baseline_time / bulk_time:.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import os
+import sys
+import time
+import numpy as np
+
+# Ensure the root directory is in the sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scripts.decentralization.calculate_metrics import (
+    calculate_gini_coefficient, calculate_nakamoto_coefficient, calculate_shannon_entropy,
+    calculate_hhi, calculate_theil_index, calculate_metrics_batch
+)
+
+# Benchmark the fused metrics kernel against the separate per-metric functions
+HOLDERS = 3000000
+BATCH_SNAPSHOTS = 30
+BATCH_HOLDERS = 100000
+REPEATS = 3
+
+def calculate_separately(amounts):
+    total_supply = np.sum(amounts)
+    return {
+        'gini_coefficient': calculate_gini_coefficient(amounts),
+        'nakamoto_coefficient': calculate_nakamoto_coefficient(amounts, total_supply),
+        'shannon_entropy': calculate_shannon_entropy(amounts),
+        'hhi': calculate_hhi(amounts),
+        'theil_index': calculate_theil_index(amounts),
+        'unique_holders': len(amounts)
+    }
+
+def best_time(function, *args):
+    timings = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        result = function(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+def check_close(expected, actual):
+    for metric, value in expected.items():
+        assert np.isclose(value, actual[metric], rtol=1e-9), (metric, value, actual[metric])
+
+def main():
+    rng = np.random.default_rng(42)
+
+    # Long-tailed balances, shuffled as the kernel cannot assume any input order
+    amounts = rng.permutation(rng.pareto(1.1, HOLDERS) * 100)
+    separate_time, expected = best_time(calculate_separately, amounts)
+    fused_time, (actual,) = best_time(calculate_metrics_batch, [amounts])
+    check_close(expected, actual)
+    print(f"Single snapshot with {HOLDERS} holders:")
+    print(f"  Separate functions: {separate_time:.3f}s")
+    print(f"  Fused kernel:       {fused_time:.3f}s ({separate_time / fused_time:.1f}x)")
+
+    batch = [rng.pareto(1.1, BATCH_HOLDERS) * 100 for _ in range(BATCH_SNAPSHOTS)]
+    separate_time, expected = best_time(lambda snapshots: [calculate_separately(a) for a in snapshots], batch)
+    fused_time, actual = best_time(calculate_metrics_batch, batch)
+    for expected_metrics, actual_metrics in zip(expected, actual):
+        check_close(expected_metrics, actual_metrics)
+    print(f"Batch of {BATCH_SNAPSHOTS} snapshots with {BATCH_HOLDERS} holders each:")
+    print(f"  Separate functions: {separate_time:.3f}s")
+    print(f"  Fused kernel:       {fused_time:.3f}s ({separate_time / fused_time:.1f}x)")
+
+if __name__ == "__main__":
+    main()
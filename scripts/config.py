@@ -12,6 +12,10 @@ SNAPSHOT_API_URL = "https://hub.snapshot.org/graphql"
 START_DATE = "2022-01-01"
 END_DATE = "2024-06-30"
 
+# Holder snapshot cadence: "monthly", "weekly" or "daily". Monthly snapshots are always fetched
+# in full, the dates in between are stored as balance changes since the previous date.
+SNAPSHOT_CADENCE = "monthly"
+
 # Paths
 DATA_PATH = "data/"
 
@@ -25,18 +29,24 @@ RAW_DATA_PATH = "data/raw/"
 PROCESSED_DATA_PATH = "data/processed/"
 METRICS_PATH = "data/metrics/"
 TOKEN_METRICS_PATH = "data/metrics/token_metrics_filtered.csv"
+METRIC_CACHE_PATH = "data/metrics/metric_cache.json"
 EXCHANGE_ADDRESSES_PATH = "data/raw/exchange_addresses.csv"
+EXCHANGE_CANDIDATES_PATH = "data/processed/exchange_candidates.csv"
+TOKEN_HOLDERS_LEDGER_PATH = "data/raw/token_holders_ledger.sqlite"
 
 
 TOKENS_PATH = "data/raw/tokens/"
 PROPOSALS_PATH = "data/raw/proposals/"
 PROPOSALS_PATH_CSV = "data/raw/proposals/proposals.csv"
 PROPOSALS_DETAILS_PATH = "data/raw/proposals/proposal_details.csv"
-PROPOSALS_VOTES_PATH = "data/raw/proposals/proposal_votes.csv"
+PROPOSALS_VOTES_PATH = "data/raw/proposals/votes/"
+SYNC_STATE_PATH = "data/raw/proposals/sync_state.json"
 
 COMBINED_TOKENS_PATH = "data/processed/combined_tokens.csv"
 CLASSIFIED_TOKENS_PATH = "data/processed/classified_tokens.csv"
 PROCESSED_TOKEN_HOLDERS_PATH = "data/processed/token_holders/"
+ADDRESS_INDEX_PATH = "data/processed/address_index.npz"
+HOLDER_SKETCHES_PATH = "data/processed/holder_sketches.npz"
 INDEX_DATA_PATH = "data/processed/index_constituents/"
 SPACES_CSV_PATH = "data/processed/space_ids.csv"
 CONSOLIDATED_INDEX_PATH = "data/processed/consolidated_index.csv"
@@ -0,0 +1,79 @@
+import os
+import sys
+import numpy as np
+
+# Ensure the root directory is in the sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scripts.config import ADDRESS_INDEX_PATH
+from scripts.decentralization.holder_store import ADDRESS_DTYPE, addresses_to_bytes, load_snapshot, mmap_snapshot, save_snapshot
+
+ADDRESS_ID_DTYPE = np.dtype('<i4')
+
+# Persistent address dictionary that gives every Ethereum address a stable integer id. Ids are
+# assigned in first-seen order and never change, so snapshots can be stored as (address_id,
+# balance) arrays and joined across dates and tokens with integer merges. The file holds
+#   addresses:        S20 addresses in id order
+#   sorted_addresses: the same addresses in byte order
+#   sorted_ids:       the id of each entry of sorted_addresses
+class AddressIndex:
+    def __init__(self, addresses=None, sorted_addresses=None, sorted_ids=None):
+        self.addresses = np.empty(0, dtype=ADDRESS_DTYPE) if addresses is None else addresses
+        if sorted_addresses is None:
+            sorted_ids = np.argsort(self.addresses, kind='stable').astype(ADDRESS_ID_DTYPE)
+            sorted_addresses = self.addresses[sorted_ids]
+        self.sorted_addresses = sorted_addresses
+        self.sorted_ids = sorted_ids
+
+    def __len__(self):
+        return len(self.addresses)
+
+    # With mmap the arrays are memory-mapped read-only, for lookups without loading the index
+    @classmethod
+    def load(cls, path=ADDRESS_INDEX_PATH, mmap=False):
+        if not os.path.exists(path):
+            return cls()
+        data = mmap_snapshot(path) if mmap else load_snapshot(path)
+        return cls(data['addresses'], data['sorted_addresses'], data['sorted_ids'])
+
+    def save(self, path=ADDRESS_INDEX_PATH):
+        save_snapshot(path, addresses=self.addresses, sorted_addresses=self.sorted_addresses, sorted_ids=self.sorted_ids)
+
+    def _search(self, addresses):
+        if not isinstance(addresses, np.ndarray) or addresses.dtype != ADDRESS_DTYPE:
+            addresses = addresses_to_bytes(addresses)
+        positions = np.searchsorted(self.sorted_addresses, addresses)
+        found = positions < len(self.sorted_addresses)
+        found[found] = self.sorted_addresses[positions[found]] == addresses[found]
+        return addresses, positions, found
+
+    def lookup(self, addresses):
+        # Ids of the given addresses (S20 array or hex strings), -1 for unknown addresses
+        addresses, positions, found = self._search(addresses)
+        ids = np.full(len(addresses), -1, dtype=ADDRESS_ID_DTYPE)
+        ids[found] = self.sorted_ids[positions[found]]
+        return ids
+
+    def intern(self, addresses):
+        # Ids of the given addresses, assigning new ids to addresses seen for the first time
+        addresses, positions, found = self._search(addresses)
+        ids = np.empty(len(addresses), dtype=ADDRESS_ID_DTYPE)
+        ids[found] = self.sorted_ids[positions[found]]
+
+        if not found.all():
+            new_addresses, first_seen, inverse = np.unique(addresses[~found], return_index=True, return_inverse=True)
+            # Number new addresses in the order they appear in the input
+            appearance = np.argsort(first_seen, kind='stable')
+            new_ids = np.empty(len(new_addresses), dtype=ADDRESS_ID_DTYPE)
+            new_ids[appearance] = len(self.addresses) + np.arange(len(new_addresses))
+            ids[~found] = new_ids[inverse.ravel()]
+
+            self.addresses = np.concatenate([self.addresses, new_addresses[appearance]])
+            insert_at = np.searchsorted(self.sorted_addresses, new_addresses)
+            self.sorted_addresses = np.insert(self.sorted_addresses, insert_at, new_addresses)
+            self.sorted_ids = np.insert(self.sorted_ids, insert_at, new_ids)
+        return ids
+
+    def addresses_for(self, ids):
+        # S20 addresses of the given ids
+        return self.addresses[np.asarray(ids)]
@@ -0,0 +1,113 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+# Ensure the root directory is in the sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scripts.config import PROCESSED_DATA_PATH, METRICS_PATH
+from scripts.decentralization.holder_store import is_truncated, list_snapshots, load_snapshot
+
+TOP_N = 100  # Size of the top-holder set used for turnover
+
+# Holder table of one snapshot, sorted by address id for merge joins, or None for a top-K snapshot
+def load_holders(file_path, filter_exchanges):
+    snapshot = load_snapshot(file_path)
+    if is_truncated(snapshot):
+        return None
+    address_id, balance = snapshot['address_id'], snapshot['balance']
+    if filter_exchanges:
+        keep = ~snapshot['is_exchange']
+        address_id, balance = address_id[keep], balance[keep]
+    # Offset pagination over tied balances can return a holder twice; sum its rows so that every
+    # id is unique, as the merge joins below require. np.unique also sorts the ids.
+    ids, inverse = np.unique(address_id, return_inverse=True)
+    return ids, np.bincount(inverse, weights=balance, minlength=len(ids))
+
+def top_holder_ids(address_id, balance, n=TOP_N):
+    if len(balance) <= n:
+        return address_id
+    return address_id[np.argpartition(balance, -n)[-n:]]
+
+# Compare two consecutive snapshots of a token. Both id arrays are sorted, so the join is a
+# single merge via intersect1d on unique inputs.
+def calculate_churn(previous, current):
+    previous_ids, previous_balance = previous
+    current_ids, current_balance = current
+    _, previous_index, current_index = np.intersect1d(previous_ids, current_ids, assume_unique=True, return_indices=True)
+
+    new_mask = np.ones(len(current_ids), dtype=bool)
+    new_mask[current_index] = False
+    exited_mask = np.ones(len(previous_ids), dtype=bool)
+    exited_mask[previous_index] = False
+
+    balance_change = current_balance[current_index] - previous_balance[previous_index]
+    previous_top = top_holder_ids(previous_ids, previous_balance)
+    current_top = top_holder_ids(current_ids, current_balance)
+    top_retained = len(np.intersect1d(previous_top, current_top, assume_unique=True))
+
+    return {
+        'previous_holders': len(previous_ids),
+        'current_holders': len(current_ids),
+        'new_holders': int(new_mask.sum()),
+        'exited_holders': int(exited_mask.sum()),
+        'retained_holders': len(current_index),
+        'retention_rate': len(current_index) / len(previous_ids) if len(previous_ids) else np.nan,
+        'new_holder_balance': current_balance[new_mask].sum(),
+        'exited_holder_balance': previous_balance[exited_mask].sum(),
+        'retained_balance_inflow': balance_change[balance_change > 0].sum(),
+        'retained_balance_outflow': -balance_change[balance_change < 0].sum(),
+        f'top_{TOP_N}_turnover': 1 - top_retained / len(current_top) if len(current_top) else np.nan
+    }
+
+def list_token_snapshots(token_holders_path):
+    # Map token id -> [(date, file path)] in date order
+    date_folders = sorted(f for f in os.listdir(token_holders_path)
+                          if os.path.isdir(os.path.join(token_holders_path, f)) and f not in ('filtered', 'unfiltered'))
+    token_snapshots = {}
+    for date_folder in date_folders:
+        date_folder_path = os.path.join(token_holders_path, date_folder)
+        for token_id, filename in list_snapshots(date_folder_path).items():
+            if filename.endswith('.npz'):
+                token_snapshots.setdefault(token_id, []).append((date_folder, os.path.join(date_folder_path, filename)))
+    return token_snapshots
+
+def main():
+    os.makedirs(METRICS_PATH, exist_ok=True)
+    token_snapshots = list_token_snapshots(os.path.join(PROCESSED_DATA_PATH, "token_holders"))
+    churn = {'filtered': [], 'unfiltered': []}
+
+    for token_id, snapshots in sorted(token_snapshots.items()):
+        print(f"Calculating holder churn for {token_id} over {len(snapshots)} snapshots")
+        for filter_type in churn:
+            # Only the previous snapshot is kept in memory while walking the token's history
+            previous_date, previous = None, None
+            for date_folder, file_path in snapshots:
+                try:
+                    current = load_holders(file_path, filter_exchanges=filter_type == 'filtered')
+                except Exception as e:
+                    print(f"Error loading file {file_path}: {e}")
+                    previous_date, previous = None, None
+                    continue
+                if current is None:
+                    # Entries and exits cannot be told apart from the missing tail of a top-K snapshot.
+                    # The next full snapshot is compared with the last full one, across the gap.
+                    print(f"Skipping top-K snapshot {file_path}")
+                    continue
+                if previous is not None:
+                    churn[filter_type].append({
+                        'token_id': token_id,
+                        'previous_date': previous_date,
+                        'date': date_folder,
+                        **calculate_churn(previous, current)
+                    })
+                previous_date, previous = date_folder, current
+
+    for filter_type, rows in churn.items():
+        output_file = os.path.join(METRICS_PATH, f"holder_churn_{filter_type}.csv")
+        pd.DataFrame(rows).to_csv(output_file, index=False)
+        print(f"Holder churn ({filter_type}) saved to {output_file}")
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,20 @@
 import os
 import pandas as pd
 from scripts.config import RAW_DATA_PATH, EXCHANGE_ADDRESSES_PATH, TOKEN_NAME_MAPPING
+from scripts.decentralization.exchange_index import load_exchange_index
 
-# Load the exchange addresses CSV
-exchange_addresses_file = os.path.join(RAW_DATA_PATH, "exchange_addresses.csv")
-exchange_addresses_df = pd.read_csv(exchange_addresses_file)
+# Load the exchange address index (token ids lowercased, addresses case-normalized and deduplicated)
+exchange_index = load_exchange_index(EXCHANGE_ADDRESSES_PATH)
 
 # Initialize a dictionary to count ignored addresses per token
 ignored_addresses_count = {token: 0 for token in TOKEN_NAME_MAPPING.values()}
 
-# Ensure all token IDs in the CSV are lowercased to match mapping
-exchange_addresses_df['id'] = exchange_addresses_df['id'].str.lower()
-
 # Count the number of ignored addresses for each token
 for token_id, token_name in TOKEN_NAME_MAPPING.items():
-    token_id_lower = token_id.lower()  # Match the CSV ID format
-    count = exchange_addresses_df[exchange_addresses_df['id'] == token_id_lower].shape[0]
-    ignored_addresses_count[token_name] = count
+    ignored_addresses_count[token_name] = exchange_index.count(token_id)
 
-# Calculate the total number of ignored exchange addresses
-total_ignored_addresses = exchange_addresses_df.shape[0]
+# Calculate the total number of unique exchange addresses ignored across all tokens
+total_ignored_addresses = exchange_index.count()
 
 # Print the results to the console
 print("Ignored Exchange Addresses per Token:")
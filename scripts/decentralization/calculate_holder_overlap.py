@@ -0,0 +1,164 @@
+import os
+import sys
+import argparse
+import numpy as np
+import pandas as pd
+
+# Ensure the root directory is in the sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scripts.config import PROCESSED_DATA_PATH, METRICS_PATH, HOLDER_SKETCHES_PATH
+from scripts.decentralization.holder_store import hash_snapshot_content, is_truncated, load_snapshot, save_snapshot
+from scripts.decentralization.calculate_metrics import list_snapshot_tasks
+
+MINHASH_PERMUTATIONS = 128  # Signature length, the Jaccard estimate has a standard error of at most 0.5 / sqrt(128)
+MINHASH_PRIME = (1 << 31) - 1  # Modulus of the hash family, larger than any address id
+MINHASH_SEED = 0  # Fixes the hash functions so stored sketches stay comparable
+SKETCH_CHUNK = 1 << 15  # Holders hashed per step, bounds memory to chunk x permutations
+
+FILTER_TYPES = ('filtered', 'unfiltered')
+
+# MinHash sketches of the holder sets. Every (token, date) snapshot is reduced to the minimum of
+# MINHASH_PERMUTATIONS universal hashes h(x) = (a * x + b) mod p over its address ids. Two
+# snapshots agree on a signature position with probability equal to the Jaccard similarity J of
+# their holder sets, and since the set sizes are known exactly the overlap follows as
+#   |A & B| = J / (1 + J) * (|A| + |B|)
+def minhash_parameters():
+    rng = np.random.default_rng(MINHASH_SEED)
+    a = rng.integers(1, MINHASH_PRIME, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+    b = rng.integers(0, MINHASH_PRIME, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+    return a[:, None], b[:, None]
+
+def build_sketch(address_ids, parameters):
+    a, b = parameters
+    signature = np.full(MINHASH_PERMUTATIONS, MINHASH_PRIME, dtype=np.uint64)
+    ids = np.asarray(address_ids).astype(np.uint64)
+    for start in range(0, len(ids), SKETCH_CHUNK):
+        hashes = (a * ids[start:start + SKETCH_CHUNK] + b) % np.uint64(MINHASH_PRIME)
+        np.minimum(signature, hashes.min(axis=1), out=signature)
+    return signature.astype(np.uint32)
+
+# Stored sketches from an earlier run, keyed by "<date>/<token_id>" with the content hash of the
+# processed snapshot they were built from
+def load_sketches():
+    if not os.path.exists(HOLDER_SKETCHES_PATH):
+        return {}
+    data = load_snapshot(HOLDER_SKETCHES_PATH)
+    if int(data['permutations']) != MINHASH_PERMUTATIONS or int(data['seed']) != MINHASH_SEED:
+        return {}
+    sketches = {}
+    for k, key in enumerate(data['keys']):
+        sketches[str(key)] = {
+            'hash': str(data['hashes'][k]),
+            'filtered': (data['filtered_signatures'][k], int(data['filtered_sizes'][k])),
+            'unfiltered': (data['unfiltered_signatures'][k], int(data['unfiltered_sizes'][k]))
+        }
+    return sketches
+
+def save_sketches(sketches):
+    keys = sorted(sketches)
+    columns = {
+        'keys': np.array(keys, dtype=str),
+        'hashes': np.array([sketches[key]['hash'] for key in keys], dtype=str),
+        'permutations': np.int64(MINHASH_PERMUTATIONS),
+        'seed': np.int64(MINHASH_SEED)
+    }
+    for filter_type in FILTER_TYPES:
+        columns[f'{filter_type}_signatures'] = np.array([sketches[key][filter_type][0] for key in keys], dtype=np.uint32).reshape(len(keys), MINHASH_PERMUTATIONS)
+        columns[f'{filter_type}_sizes'] = np.array([sketches[key][filter_type][1] for key in keys], dtype=np.int64)
+    save_snapshot(HOLDER_SKETCHES_PATH, **columns)
+
+# Holder ids of one snapshot, or None for a top-K snapshot, whose missing tail would understate overlaps
+def load_holder_ids(file_path):
+    snapshot = load_snapshot(file_path)
+    if is_truncated(snapshot):
+        return None
+    address_id = snapshot['address_id']
+    return {'filtered': np.unique(address_id[~snapshot['is_exchange']]), 'unfiltered': np.unique(address_id)}
+
+# Jaccard estimates of all pairs of one date at once from the stacked signatures
+def estimate_overlaps(signatures, sizes):
+    jaccard = (signatures[:, None, :] == signatures[None, :, :]).mean(axis=2)
+    total = sizes[:, None] + sizes[None, :]
+    overlap = jaccard / (1 + jaccard) * total
+    return jaccard, overlap
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Estimate holder overlap between all token pairs with MinHash sketches.")
+    parser.add_argument('--exact', action='store_true', help="Also compute exact overlaps with set intersections, for validation")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    os.makedirs(METRICS_PATH, exist_ok=True)
+    parameters = minhash_parameters()
+    tasks = [task for task in list_snapshot_tasks(os.path.join(PROCESSED_DATA_PATH, "token_holders")) if task[2].endswith('.npz')]
+
+    previous_sketches = load_sketches()
+    sketches = {}
+    built = 0
+    truncated = 0
+    for date_folder, token_id, file_path in tasks:
+        key = f"{date_folder}/{token_id}"
+        content_hash = hash_snapshot_content(file_path)
+        if key in previous_sketches and previous_sketches[key]['hash'] == content_hash:
+            sketches[key] = previous_sketches[key]
+            continue
+        try:
+            holder_ids = load_holder_ids(file_path)
+        except Exception as e:
+            print(f"Error loading file {file_path}: {e}")
+            continue
+        if holder_ids is None:
+            truncated += 1
+            continue
+        sketches[key] = {'hash': content_hash}
+        for filter_type in FILTER_TYPES:
+            sketches[key][filter_type] = (build_sketch(holder_ids[filter_type], parameters), len(holder_ids[filter_type]))
+        built += 1
+    save_sketches(sketches)
+    print(f"Built {built} sketches, reused {len(sketches) - built}, saved to {HOLDER_SKETCHES_PATH}")
+    if truncated:
+        print(f"Skipped {truncated} top-K snapshots")
+
+    tokens_by_date = {}
+    for date_folder, token_id, file_path in tasks:
+        if f"{date_folder}/{token_id}" in sketches:
+            tokens_by_date.setdefault(date_folder, []).append((token_id, file_path))
+
+    overlaps = {filter_type: [] for filter_type in FILTER_TYPES}
+    for date_folder, tokens in sorted(tokens_by_date.items()):
+        print(f"Estimating holder overlap of {len(tokens)} tokens on {date_folder}")
+        exact_ids = [load_holder_ids(file_path) for _, file_path in tokens] if args.exact else None
+        for filter_type in FILTER_TYPES:
+            entries = [sketches[f"{date_folder}/{token_id}"][filter_type] for token_id, _ in tokens]
+            signatures = np.array([signature for signature, _ in entries])
+            sizes = np.array([size for _, size in entries], dtype=float)
+            jaccard, overlap = estimate_overlaps(signatures, sizes)
+
+            for i in range(len(tokens)):
+                for j in range(i + 1, len(tokens)):
+                    empty = not sizes[i] or not sizes[j]
+                    row = {
+                        'date': date_folder,
+                        'token_a': tokens[i][0],
+                        'token_b': tokens[j][0],
+                        'holders_a': int(sizes[i]),
+                        'holders_b': int(sizes[j]),
+                        'jaccard': np.nan if empty else jaccard[i, j],
+                        'jaccard_stderr': np.nan if empty else np.sqrt(jaccard[i, j] * (1 - jaccard[i, j]) / MINHASH_PERMUTATIONS),
+                        'overlap': 0 if empty else overlap[i, j]
+                    }
+                    if args.exact:
+                        exact = len(np.intersect1d(exact_ids[i][filter_type], exact_ids[j][filter_type], assume_unique=True))
+                        row['exact_overlap'] = exact
+                        row['exact_jaccard'] = exact / (sizes[i] + sizes[j] - exact) if not empty else np.nan
+                    overlaps[filter_type].append(row)
+
+    for filter_type, rows in overlaps.items():
+        output_file = os.path.join(METRICS_PATH, f"holder_overlap_{filter_type}.csv")
+        pd.DataFrame(rows).to_csv(output_file, index=False)
+        print(f"Holder overlap ({filter_type}) saved to {output_file}")
+
+if __name__ == "__main__":
+    main()
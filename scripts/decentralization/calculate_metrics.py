@@ -1,12 +1,19 @@
 import os
 import sys
+import argparse
+import hashlib
+import json
+import zlib
 import pandas as pd
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 
 # Ensure the root directory is in the sys.path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from scripts.config import PROCESSED_DATA_PATH, METRICS_PATH
+from scripts.config import PROCESSED_DATA_PATH, METRICS_PATH, METRIC_CACHE_PATH
+from scripts.decentralization.holder_store import hash_snapshot_content, list_snapshots
+from scripts.decentralization.holder_deltas import PROCESSED_DELTAS_PATH, load_processed_snapshot, processed_snapshot_files
 
 def calculate_gini_coefficient(amounts):
     n = len(amounts)
@@ -50,66 +57,491 @@ def calculate_theil_index(amounts):
     theil_index = np.mean(proportions * np.log(proportions))
     return theil_index
 
-def process_token_file(file_path):
-    df = pd.read_csv(file_path)
-    amounts = df['Amount'].values.astype(float)
-    total_supply = np.sum(amounts)
+# Bump whenever the metric code changes so that cached results are recomputed
+METRICS_VERSION = 2
+
+# Minimum balances (in tokens) for the threshold sweep
+SWEEP_THRESHOLDS = [0, 1, 10, 100, 1000]
+
+BOOTSTRAP_CONFIDENCE = 0.95  # Coverage of the percentile bootstrap intervals
+BOOTSTRAP_SEED = 0  # Combined with the snapshot key so every snapshot draws its own resamples
+BOOTSTRAP_CHUNK_ELEMENTS = 1 << 20  # Replicates x holders evaluated per matrix chunk, bounds memory use
+
+METRIC_COLUMNS = ['gini_coefficient', 'nakamoto_coefficient', 'shannon_entropy', 'hhi', 'theil_index', 'unique_holders']
+
+# Inequality metrics reported next to METRIC_COLUMNS
+TOP_SHARE_SIZES = [1, 10, 100]
+ATKINSON_EPSILONS = [0.5, 1, 2]
+EXTENDED_COLUMNS = ([f'top_{size}_share' for size in TOP_SHARE_SIZES] + ['palma_ratio'] +
+                    [f'atkinson_{epsilon}'.replace('.', '_') for epsilon in ATKINSON_EPSILONS])
+
+LORENZ_POINTS = 101  # Lorenz curves are stored at population shares 0, 0.01, ..., 1
+
+# Metrics that get bootstrap confidence intervals, and the columns these are reported in
+BOOTSTRAPPED_METRICS = ['gini_coefficient', 'shannon_entropy', 'hhi', 'theil_index']
+BOOTSTRAP_COLUMNS = [f'{metric}_ci_{bound}' for metric in BOOTSTRAPPED_METRICS for bound in ('low', 'high')]
+
+# Shared intermediates of one snapshot: the balances are sorted once in ascending order and
+# every metric is derived from their cumulative sums and a handful of dot products
+def summarize_snapshot(amounts):
+    x = np.sort(np.asarray(amounts, dtype=float))
+    if not len(x):
+        return None
+    cumulative = np.cumsum(x)
+    total = cumulative[-1]
+    positive = x > 0
+    log_x = np.log(x) if positive.all() else np.log(np.where(positive, x, 1.0))  # zero balances contribute nothing
+    return {
+        'n': len(x),
+        'positive_count': np.count_nonzero(positive),
+        'total': total,
+        'sum_cumulative': cumulative.sum(),
+        'sum_squares': x @ x,
+        'sum_x_log_x': x @ log_x,
+        # Number of smallest holders that together own less than half of the supply
+        'below_half': np.searchsorted(cumulative, 0.5 * total, side='left')
+    }
+
+# Evaluate every metric for a batch of snapshot summaries at once, given as arrays with one
+# entry per snapshot:
+#   Gini     = ((n + 1) * S - 2 * sum(C)) / (n * S), with C the ascending cumulative sums
+#   Nakamoto = n - number of smallest holders owning less than S / 2
+#   HHI      = sum(x^2) / S^2
+#   Shannon  = log2(S) - sum(x * log2(x)) / S
+#   Theil    = (sum(x * ln(x)) - S * ln(mean)) / (positive holders * mean)
+def evaluate_summaries(stacked):
+    n = stacked['n'].astype(float)
+    total = stacked['total']
+    mean = total / n
+
+    gini = ((n + 1) * total - 2 * stacked['sum_cumulative']) / (n * total)
+    nakamoto = stacked['n'] - stacked['below_half']
+    hhi = stacked['sum_squares'] / total ** 2
+    shannon_entropy = (np.log(total) - stacked['sum_x_log_x'] / total) / np.log(2)
+    theil_index = (stacked['sum_x_log_x'] - total * np.log(mean)) / (stacked['positive_count'] * mean)
+
+    return [{
+        'gini_coefficient': gini[k],
+        'nakamoto_coefficient': int(nakamoto[k]),
+        'shannon_entropy': shannon_entropy[k],
+        'hhi': hhi[k],
+        'theil_index': theil_index[k],
+        'unique_holders': int(stacked['n'][k])
+    } for k in range(len(n))]
+
+def empty_metrics():
+    return dict(zip(METRIC_COLUMNS, [np.nan, 0, np.nan, np.nan, np.nan, 0]))
+
+# Fused metrics kernel for a batch of snapshots. Each snapshot is summarized in a single sorted
+# pass, then all metrics are evaluated for the whole batch from the stacked summaries.
+def calculate_metrics_batch(amounts_list):
+    results = [empty_metrics() for _ in amounts_list]
+    summaries = [summarize_snapshot(amounts) for amounts in amounts_list]
+    non_empty = [k for k, summary in enumerate(summaries) if summary is not None]
+    if not non_empty:
+        return results
+
+    stacked = {key: np.array([summaries[k][key] for k in non_empty]) for key in summaries[non_empty[0]]}
+    for k, metrics in zip(non_empty, evaluate_summaries(stacked)):
+        results[k] = metrics
+    return results
+
+# Metrics of the holders with a balance of at least each threshold, from one sort of the snapshot.
+# Every threshold keeps a suffix x[j:] of the ascending balances, so its summary follows from
+# prefix sums P of x, x^2, x * ln(x) and of the cumulative sums C:
+#   S = P[n] - P[j],  sum(C over the suffix) = (PC[n] - PC[j]) - (n - j) * P[j]
+# Zero balances are never counted, so threshold 0 matches the unswept metrics.
+def calculate_threshold_sweep(amounts, thresholds):
+    x = np.sort(np.asarray(amounts, dtype=float))
+    x = x[np.searchsorted(x, 0, side='right'):]
+    thresholds = np.asarray(thresholds, dtype=float)
+    results = [empty_metrics() for _ in thresholds]
+
+    def prefix(values):
+        return np.concatenate([[0.0], np.cumsum(values)])
+    cumulative = prefix(x)
+    cumulative_of_cumulative = prefix(cumulative[1:])
+    squares = prefix(x * x)
+    x_log_x = prefix(x * np.log(x))
+
+    start = np.searchsorted(x, thresholds, side='left')
+    count = len(x) - start
+    non_empty = np.flatnonzero(count > 0)
+    if not len(non_empty):
+        return results
+    start, count = start[non_empty], count[non_empty]
+
+    total = cumulative[-1] - cumulative[start]
+    stacked = {
+        'n': count,
+        'positive_count': count,
+        'total': total,
+        'sum_cumulative': (cumulative_of_cumulative[-1] - cumulative_of_cumulative[start]) - count * cumulative[start],
+        'sum_squares': squares[-1] - squares[start],
+        'sum_x_log_x': x_log_x[-1] - x_log_x[start],
+        'below_half': np.searchsorted(cumulative[1:], cumulative[start] + 0.5 * total, side='left') - start
+    }
+    for k, metrics in zip(non_empty, evaluate_summaries(stacked)):
+        results[k] = metrics
+    return results
+
+def calculate_token_metrics(amounts):
+    return calculate_metrics_batch([amounts])[0]
+
+# Percentile bootstrap intervals of Gini, Theil, HHI and Shannon entropy. A resample of n holders
+# drawn with replacement is a weight vector w of draw counts, so all replicates of a chunk are
+# drawn at once as a (replicates x n) count matrix and evaluated with matrix operations on the
+# balances x, sorted once in ascending order:
+#   S = w.x,  HHI = (w.x^2) / S^2,  Shannon = (ln S - w.(x ln x) / S) / ln 2
+#   Theil = w.(x ln x) / S - ln(S / n)
+#   Gini = 1 - (2 * sum(w * L) + sum(w^2 * x)) / (n * S), L = supply of the smaller holders
+# Drawing and counting the indices dominates, so this is only 1.6-1.8x faster than resampling in
+# a loop (see scripts/benchmarks/benchmark_bootstrap.py).
+def bootstrap_metric_intervals(amounts, replicates, confidence=BOOTSTRAP_CONFIDENCE, seed=BOOTSTRAP_SEED):
+    x = np.sort(np.asarray(amounts, dtype=float))
+    x = x[np.searchsorted(x, 0, side='right'):]
+    n = len(x)
+    if not n or replicates < 1:
+        return {column: np.nan for column in BOOTSTRAP_COLUMNS}
+
+    rng = np.random.default_rng(seed)
+    x_log_x = x * np.log(x)
+    estimates = {metric: np.empty(replicates) for metric in BOOTSTRAPPED_METRICS}
+    chunk_size = max(1, BOOTSTRAP_CHUNK_ELEMENTS // n)
+    for start in range(0, replicates, chunk_size):
+        rows = min(chunk_size, replicates - start)
+        # Draw counts of every holder in every replicate via one bincount over offset indices
+        draws = rng.integers(0, n, size=(rows, n)) + (np.arange(rows) * n)[:, None]
+        weights = np.bincount(draws.ravel(), minlength=rows * n).reshape(rows, n).astype(float)
+        del draws
+
+        weighted = weights * x
+        total = weighted.sum(axis=1)
+        smaller = np.cumsum(weighted, axis=1)
+        smaller -= weighted
+        chunk = slice(start, start + rows)
+        estimates['gini_coefficient'][chunk] = 1 - (2 * np.einsum('ij,ij->i', weights, smaller) + np.einsum('ij,ij->i', weights, weighted)) / (n * total)
+        estimates['hhi'][chunk] = (weights @ (x * x)) / total ** 2
+        sum_x_log_x = weights @ x_log_x
+        estimates['shannon_entropy'][chunk] = (np.log(total) - sum_x_log_x / total) / np.log(2)
+        estimates['theil_index'][chunk] = sum_x_log_x / total - np.log(total / n)
+
+    tail = 50 * (1 - confidence)
+    intervals = {}
+    for metric, values in estimates.items():
+        intervals[f'{metric}_ci_low'], intervals[f'{metric}_ci_high'] = np.percentile(values, [tail, 100 - tail])
+    return intervals
+
+# Top-holder shares, Palma ratio and Atkinson indices of a snapshot:
+#   top_N_share  = supply of the N largest holders / S
+#   Palma ratio  = supply of the richest 10% / supply of the poorest 40%
+#   Atkinson(e)  = 1 - (mean(x^(1-e)))^(1/(1-e)) / mean, and 1 - geometric mean / mean for e = 1
+# Population shares that split a holder are interpolated along the Lorenz curve.
+def calculate_extended_metrics(amounts):
+    x = np.sort(np.asarray(amounts, dtype=float))
+    x = x[np.searchsorted(x, 0, side='right'):]
+    n = len(x)
+    if not n:
+        return {column: np.nan for column in EXTENDED_COLUMNS}
+
+    cumulative = np.concatenate([[0.0], np.cumsum(x)])
+    total = cumulative[-1]
+    mean = total / n
+    lorenz = lambda share: np.interp(share * n, np.arange(n + 1), cumulative) / total
+
+    result = {f'top_{size}_share': (total - cumulative[max(n - size, 0)]) / total for size in TOP_SHARE_SIZES}
+    bottom_40 = lorenz(0.4)
+    result['palma_ratio'] = (1 - lorenz(0.9)) / bottom_40 if bottom_40 > 0 else np.nan
+    relative = x / mean
+    for epsilon in ATKINSON_EPSILONS:
+        if epsilon == 1:
+            equally_distributed = np.exp(np.log(relative).mean())
+        else:
+            equally_distributed = np.mean(relative ** (1 - epsilon)) ** (1 / (1 - epsilon))
+        result[f'atkinson_{epsilon}'.replace('.', '_')] = 1 - equally_distributed
+    return result
 
-    gini = calculate_gini_coefficient(amounts)
-    nakamoto = calculate_nakamoto_coefficient(amounts, total_supply)
-    shannon_entropy = calculate_shannon_entropy(amounts)
-    hhi = calculate_hhi(amounts)
-    theil_index = calculate_theil_index(amounts)
-    unique_holders = len(df)
+# Lorenz curve of a snapshot down-sampled to LORENZ_POINTS evenly spaced population shares,
+# as the share of supply held by the poorest holders at each point
+def calculate_lorenz_curve(amounts, points=LORENZ_POINTS):
+    x = np.sort(np.asarray(amounts, dtype=float))
+    x = x[np.searchsorted(x, 0, side='right'):]
+    if not len(x):
+        return []
+    cumulative = np.concatenate([[0.0], np.cumsum(x)])
+    population_share = np.linspace(0, 1, points)
+    return (np.interp(population_share * len(x), np.arange(len(x) + 1), cumulative) / cumulative[-1]).tolist()
 
-    return gini, nakamoto, shannon_entropy, hhi, theil_index, unique_holders
+# Extra columns reported for snapshots fetched in top-K mode
+TRUNCATED_COLUMNS = ['truncated_top_k', 'top_k_share', 'nakamoto_coefficient_high',
+                     'gini_coefficient_low', 'gini_coefficient_high', 'shannon_entropy_low', 'shannon_entropy_high',
+                     'hhi_low', 'hhi_high', 'theil_index_low', 'theil_index_high']
+
+# Gini, HHI, Shannon and Theil of a distribution given as distinct ascending values with the
+# number of holders at each value. Zero values count as holders but carry no supply.
+def calculate_grouped_metrics(values, counts):
+    values = np.asarray(values, dtype=float)
+    counts = np.asarray(counts, dtype=float)
+    n = counts.sum()
+    supply = counts * values
+    total = supply.sum()
+    before = np.cumsum(supply) - supply  # supply held by all smaller holders
+    positive = values > 0
+    sum_x_log_x = supply[positive] @ np.log(values[positive])
+    return {
+        'gini_coefficient': 1 - (2 * counts @ before + counts ** 2 @ values) / (n * total),
+        'hhi': supply @ values / total ** 2,
+        'shannon_entropy': (np.log(total) - sum_x_log_x / total) / np.log(2),
+        'theil_index': sum_x_log_x / total - np.log(total / n)
+    }
+
+# Metrics of a snapshot of which only the top_k largest balances are known, together with the
+# total supply and holder count of the full distribution. The R = total_supply - sum(top) tokens
+# of the m = holder_count - top_k tail holders are unknown, but every tail balance is at most
+# the smallest top balance b.
+#   Nakamoto and the top-K share are exact whenever the top holders own more than half of the supply.
+#   Otherwise the Nakamoto coefficient lies between K + (S/2 - sum(top)) / b and the count reached
+#   when the tail is spread evenly.
+#   Gini, HHI and Theil are smallest when the tail is spread evenly (R / m each) and largest when
+#   it is packed into as few holders as possible (floor(R / b) holders at b, one holder with the
+#   remainder, the rest with next to nothing). Shannon entropy is bounded the other way round.
+#   The reported values are the midpoints of these bounds. The error is at most half the width of
+#   the bounds, which shrinks with the tail share R / S.
+def calculate_truncated_metrics(top_amounts, total_supply, holder_count):
+    top = np.sort(np.asarray(top_amounts, dtype=float))
+    k = len(top)
+    holder_count = max(int(holder_count), k)
+    if not k or total_supply <= 0:
+        return calculate_token_metrics(top)
+
+    top_sum = top.sum()
+    tail_supply = max(float(total_supply) - top_sum, 0.0)
+    tail_holders = holder_count - k
+    total = top_sum + tail_supply
+    if not tail_holders or not tail_supply:
+        tail_supply, tail_holders = 0.0, 0  # nothing is missing, the bounds collapse
+    smallest = top[0]
+
+    even_values, even_counts = [], []
+    packed_values, packed_counts = [], []
+    if tail_holders:
+        even_values, even_counts = [tail_supply / tail_holders], [tail_holders]
+        full = min(int(tail_supply // smallest), tail_holders)
+        remainder = tail_supply - full * smallest if full < tail_holders else 0.0
+        empty = tail_holders - full - (1 if remainder > 0 else 0)
+        packed_values = [0.0, remainder, smallest]
+        packed_counts = [empty, 1 if remainder > 0 else 0, full]
+    even = calculate_grouped_metrics(even_values + list(top), even_counts + [1] * k)
+    packed = calculate_grouped_metrics(packed_values + list(top), packed_counts + [1] * k)
+
+    # Nakamoto coefficient from the largest holders downwards
+    threshold = 0.5 * total
+    descending = np.cumsum(top[::-1])
+    if descending[-1] > threshold:
+        nakamoto_low = nakamoto_high = int(np.searchsorted(descending, threshold, side='right')) + 1
+    else:
+        missing = threshold - descending[-1]
+        nakamoto_low = k + int(missing // smallest) + 1
+        nakamoto_high = k + int(missing // (tail_supply / tail_holders)) + 1 if tail_holders else k
+        nakamoto_low, nakamoto_high = min(nakamoto_low, holder_count), min(nakamoto_high, holder_count)
+
+    result = {'nakamoto_coefficient': nakamoto_low, 'unique_holders': holder_count,
+              'truncated_top_k': k, 'top_k_share': top_sum / total, 'nakamoto_coefficient_high': nakamoto_high}
+    for metric in ('gini_coefficient', 'hhi', 'theil_index', 'shannon_entropy'):
+        low, high = sorted((even[metric], packed[metric]))
+        result[metric] = (low + high) / 2
+        result[f'{metric}_low'] = low
+        result[f'{metric}_high'] = high
+    return result
+
+# Top shares of a top-K snapshot, exact for every size up to K as the total supply is known
+def calculate_truncated_extended_metrics(top_amounts, total_supply):
+    top = np.sort(np.asarray(top_amounts, dtype=float))[::-1]
+    result = {column: np.nan for column in EXTENDED_COLUMNS}
+    for size in TOP_SHARE_SIZES:
+        if size <= len(top) and total_supply > 0:
+            result[f'top_{size}_share'] = top[:size].sum() / total_supply
+    return result
+
+# Load a processed snapshot once and derive everything with and without exchange addresses:
+#   metrics: one row of METRIC_COLUMNS and EXTENDED_COLUMNS, plus bootstrap intervals when
+#            bootstrap > 0
+#   sweep:   one row of METRIC_COLUMNS per threshold
+#   lorenz:  the down-sampled Lorenz curve
+# Each is keyed by filter type.
+def process_token_file(file_path, thresholds=SWEEP_THRESHOLDS, bootstrap=0, seed=BOOTSTRAP_SEED):
+    snapshot = load_processed_snapshot(file_path)
+    balance = snapshot['balance']
+    is_exchange = snapshot['is_exchange']
+    if 'holder_count' in snapshot:
+        # Top-K snapshot: only exchanges among the top holders can be removed from the totals.
+        # The tail balances are unknown, so no sweep, bootstrap or Lorenz curve is computed.
+        total_supply, holder_count = float(snapshot['total_supply']), int(snapshot['holder_count'])
+        filtered_supply = total_supply - balance[is_exchange].sum()
+        filtered = calculate_truncated_metrics(balance[~is_exchange], filtered_supply, holder_count - np.count_nonzero(is_exchange))
+        unfiltered = calculate_truncated_metrics(balance, total_supply, holder_count)
+        filtered.update(calculate_truncated_extended_metrics(balance[~is_exchange], filtered_supply))
+        unfiltered.update(calculate_truncated_extended_metrics(balance, total_supply))
+        return {
+            'metrics': {'filtered': filtered, 'unfiltered': unfiltered},
+            'sweep': {'filtered': [], 'unfiltered': []},
+            'lorenz': {'filtered': [], 'unfiltered': []}
+        }
+
+    balances = {'filtered': balance[~is_exchange], 'unfiltered': balance}
+    metrics = dict(zip(balances, calculate_metrics_batch(list(balances.values()))))
+    for filter_type, amounts in balances.items():
+        metrics[filter_type].update(calculate_extended_metrics(amounts))
+        if bootstrap:
+            metrics[filter_type].update(bootstrap_metric_intervals(amounts, bootstrap, seed=seed))
+    return {
+        'metrics': metrics,
+        'sweep': {filter_type: calculate_threshold_sweep(amounts, thresholds) for filter_type, amounts in balances.items()},
+        'lorenz': {filter_type: calculate_lorenz_curve(amounts) for filter_type, amounts in balances.items()}
+    }
+
+# Worker entry point: compute the outputs of one (date, token) snapshot
+def process_snapshot_task(task):
+    date_folder, token_id, file_path, options = task
+    seed = [BOOTSTRAP_SEED, zlib.crc32(f"{date_folder}/{token_id}".encode())]
+    try:
+        return date_folder, token_id, process_token_file(file_path, options['thresholds'], options['bootstrap'], seed), None
+    except Exception as e:
+        return date_folder, token_id, None, f"Error processing file {file_path}: {e}"
+
+def list_snapshot_tasks(token_holders_path):
+    # Skip the filtered/unfiltered folders left over from the previous two-copy layout
+    date_folders = sorted(f for f in os.listdir(token_holders_path)
+                          if os.path.isdir(os.path.join(token_holders_path, f)) and f not in ('filtered', 'unfiltered'))
+    tasks = []
+    for date_folder in date_folders:
+        date_folder_path = os.path.join(token_holders_path, date_folder)
+        for token_id, filename in list_snapshots(date_folder_path).items():
+            tasks.append((date_folder, token_id, os.path.join(date_folder_path, filename)))
+    return tasks
+
+# Delta snapshots of SNAPSHOT_CADENCE, listed like list_snapshot_tasks. Their metrics are
+# computed on the rebuilt full snapshot.
+def list_delta_tasks(deltas_path=PROCESSED_DELTAS_PATH):
+    if not os.path.isdir(deltas_path):
+        return []
+    return list_snapshot_tasks(deltas_path)
+
+# Content hash of a processed snapshot, covering the anchor and all deltas a delta is built from.
+# Only the stored columns are hashed, so reprocessing unchanged raw data keeps the cache valid.
+def hash_snapshot(file_path):
+    files = processed_snapshot_files(file_path)
+    if len(files) == 1:
+        return hash_snapshot_content(files[0])
+    return hashlib.sha1(''.join(hash_snapshot_content(path) for path in files).encode()).hexdigest()
+
+# The metric cache maps "<date>/<token_id>" to the content hash of the processed snapshot, the
+# metrics version, the options (sweep thresholds and bootstrap replicates) and the outputs of
+# process_token_file, so unchanged snapshots are never recomputed
+def load_metric_cache():
+    if not os.path.exists(METRIC_CACHE_PATH):
+        return {}
+    try:
+        with open(METRIC_CACHE_PATH) as f:
+            return json.load(f)
+    except ValueError:
+        print(f"Ignoring unreadable metric cache {METRIC_CACHE_PATH}")
+        return {}
+
+def save_metric_cache(cache):
+    tmp_path = METRIC_CACHE_PATH + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(cache, f)
+    os.replace(tmp_path, METRIC_CACHE_PATH)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Calculate decentralization metrics for all processed token holder snapshots.")
+    parser.add_argument('--workers', type=int, default=1, help="Number of worker processes (default: 1, no pool)")
+    parser.add_argument('--thresholds', type=float, nargs='+', default=SWEEP_THRESHOLDS,
+                        help=f"Minimum balances for the threshold sweep (default: {' '.join(map(str, SWEEP_THRESHOLDS))})")
+    parser.add_argument('--bootstrap', type=int, default=0, metavar='B',
+                        help="Add percentile bootstrap intervals from B replicates to the metrics (default: 0, off)")
+    parser.add_argument('--no-cache', action='store_true', help="Recompute every snapshot instead of reusing cached metrics")
+    return parser.parse_args()
 
 def main():
+    args = parse_args()
     os.makedirs(METRICS_PATH, exist_ok=True)
-    metrics_filtered = []
-    metrics_unfiltered = []
-
-    for filter_type in ['filtered', 'unfiltered']:
-        filter_path = os.path.join(PROCESSED_DATA_PATH, "token_holders", filter_type)
-        date_folders = [f for f in os.listdir(filter_path) if os.path.isdir(os.path.join(filter_path, f))]
-        
-        for date_folder in date_folders:
-            date_folder_path = os.path.join(filter_path, date_folder)
-            files = [f for f in os.listdir(date_folder_path) if f.endswith('.csv')]
-            
-            print(f"\nProcessing {filter_type} data for {date_folder}: {len(files)} files found.")
-            
-            for i, filename in enumerate(files):
-                token_id = filename.replace('.csv', '')
-                file_path = os.path.join(date_folder_path, filename)
-                
-                try:
-                    gini, nakamoto, shannon_entropy, hhi, theil_index, unique_holders = process_token_file(file_path)
-                    metric_entry = {
-                        'date': date_folder,
-                        'token_id': token_id,
-                        'gini_coefficient': gini,
-                        'nakamoto_coefficient': nakamoto,
-                        'shannon_entropy': shannon_entropy,
-                        'hhi': hhi,
-                        'theil_index': theil_index,
-                        'unique_holders': unique_holders
-                    }
-                    
-                    if filter_type == 'filtered':
-                        metrics_filtered.append(metric_entry)
-                    else:
-                        metrics_unfiltered.append(metric_entry)
-                    
-                    if i % 10 == 0:
-                        print(f"Processed {i + 1}/{len(files)} files for {date_folder}")
-                
-                except Exception as e:
-                    print(f"Error processing file {file_path}: {e}")
-
-    metrics_filtered_df = pd.DataFrame(metrics_filtered)
-    metrics_unfiltered_df = pd.DataFrame(metrics_unfiltered)
-    
+    metrics = {'filtered': [], 'unfiltered': []}
+    sweep = {'filtered': [], 'unfiltered': []}
+    lorenz = {'filtered': [], 'unfiltered': []}
+    options = {'thresholds': sorted(set(args.thresholds)), 'bootstrap': max(args.bootstrap, 0)}
+
+    tasks = list_snapshot_tasks(os.path.join(PROCESSED_DATA_PATH, "token_holders"))
+    tasks = sorted(tasks + list_delta_tasks(), key=lambda task: task[:2])
+    previous_cache = {} if args.no_cache else load_metric_cache()
+    cache = {}
+    pending = []
+    for task in tasks:
+        date_folder, token_id, file_path = task
+        key = f"{date_folder}/{token_id}"
+        try:
+            content_hash = hash_snapshot(file_path)
+        except FileNotFoundError as e:
+            print(f"Skipping {key}: {e}")
+            continue
+        entry = previous_cache.get(key)
+        if entry and entry['hash'] == content_hash and entry['version'] == METRICS_VERSION and entry.get('options') == options:
+            cache[key] = entry
+        else:
+            cache[key] = {'hash': content_hash, 'version': METRICS_VERSION, 'options': options}
+            pending.append(task + (options,))
+    print(f"Found {len(tasks)} snapshots, {len(tasks) - len(pending)} cached, computing {len(pending)} with {args.workers} worker(s).")
+
+    if args.workers > 1:
+        executor = ProcessPoolExecutor(max_workers=args.workers)
+        results = executor.map(process_snapshot_task, pending, chunksize=max(1, len(pending) // (4 * args.workers)))
+    else:
+        executor = None
+        results = map(process_snapshot_task, pending)
+
+    for i, (date_folder, token_id, outputs, error) in enumerate(results):
+        key = f"{date_folder}/{token_id}"
+        if error:
+            print(error)
+            del cache[key]
+            continue
+        cache[key].update(outputs)
+        if i % 10 == 0:
+            print(f"Processed {i + 1}/{len(pending)} snapshots")
+
+    if executor:
+        executor.shutdown()
+
+    # Snapshots that no longer exist drop out of the cache
+    save_metric_cache(cache)
+
+    for date_folder, token_id, file_path in tasks:
+        entry = cache.get(f"{date_folder}/{token_id}")
+        if entry:
+            for filter_type, row in entry['metrics'].items():
+                metrics[filter_type].append({'date': date_folder, 'token_id': token_id, **row})
+            # Tidy layout: one row per (date, token, threshold, metric)
+            for filter_type, rows in entry['sweep'].items():
+                for threshold, row in zip(entry['options']['thresholds'], rows):
+                    for metric in METRIC_COLUMNS:
+                        sweep[filter_type].append({'date': date_folder, 'token_id': token_id, 'threshold': threshold,
+                                                   'metric': metric, 'value': row[metric]})
+            for filter_type, curve in entry['lorenz'].items():
+                for population_share, supply_share in zip(np.linspace(0, 1, len(curve)), curve):
+                    lorenz[filter_type].append({'date': date_folder, 'token_id': token_id,
+                                                'population_share': round(population_share, 6), 'supply_share': supply_share})
+
+    # Tasks are sorted and map() preserves their order, so the output is deterministic. The bound
+    # columns only appear when top-K snapshots are present, the intervals only with --bootstrap.
+    columns = ['date', 'token_id'] + METRIC_COLUMNS + EXTENDED_COLUMNS
+    if options['bootstrap']:
+        columns += BOOTSTRAP_COLUMNS
+    if any('truncated_top_k' in row for row in metrics['unfiltered']):
+        columns += TRUNCATED_COLUMNS
+    metrics_filtered_df = pd.DataFrame(metrics['filtered'], columns=columns)
+    metrics_unfiltered_df = pd.DataFrame(metrics['unfiltered'], columns=columns)
+
     output_filtered_file = os.path.join(METRICS_PATH, "token_metrics_filtered.csv")
     output_unfiltered_file = os.path.join(METRICS_PATH, "token_metrics_unfiltered.csv")
 
@@ -119,5 +551,15 @@ def main():
     print(f"\nFiltered metrics saved to {output_filtered_file}")
     print(f"Unfiltered metrics saved to {output_unfiltered_file}")
 
+    for filter_type, rows in sweep.items():
+        output_file = os.path.join(METRICS_PATH, f"token_metrics_threshold_sweep_{filter_type}.csv")
+        pd.DataFrame(rows, columns=['date', 'token_id', 'threshold', 'metric', 'value']).to_csv(output_file, index=False)
+        print(f"Threshold sweep ({filter_type}) saved to {output_file}")
+
+    for filter_type, rows in lorenz.items():
+        output_file = os.path.join(METRICS_PATH, f"lorenz_curves_{filter_type}.csv")
+        pd.DataFrame(rows, columns=['date', 'token_id', 'population_share', 'supply_share']).to_csv(output_file, index=False)
+        print(f"Lorenz curves ({filter_type}) saved to {output_file}")
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
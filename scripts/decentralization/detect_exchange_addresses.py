@@ -0,0 +1,168 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+# Ensure the root directory is in the sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scripts.config import PROCESSED_DATA_PATH, EXCHANGE_CANDIDATES_PATH
+from scripts.decentralization.holder_store import is_truncated, load_snapshot, bytes_to_addresses
+from scripts.decentralization.address_index import AddressIndex
+from scripts.decentralization.exchange_index import load_exchange_index
+from scripts.decentralization.calculate_metrics import list_snapshot_tasks
+
+TOP_N = 100  # Size of the top-holder set of every snapshot
+MIN_CANDIDATE_SCORE = 0.3  # Addresses scoring below this are not written out
+VANITY_ZERO_BYTES = 4  # Addresses starting with this many zero bytes were mined on purpose, nearly always contracts
+
+# Known non-circulating addresses
+BURN_ADDRESSES = {
+    bytes(20): 'null_address',
+    bytes.fromhex('000000000000000000000000000000000000dead'): 'burn_address',
+    bytes.fromhex('dead000000000000000042069420694206942069'): 'burn_address',
+}
+
+# Score weights of the behavioural features, summing to 1
+SCORE_WEIGHTS = {
+    'cross_token_top': 0.35,  # in the top N of several tokens
+    'top_persistence': 0.25,  # stays in the top N snapshot after snapshot
+    'token_breadth': 0.2,  # holds many of the tokens at all
+    'turnover': 0.2,  # moves a large part of its balance between snapshots
+}
+
+# Per-address statistics gathered in one pass over all processed snapshots. Everything is kept
+# in dense arrays indexed by address id, so every snapshot costs a few vectorized scatters and the
+# state never grows beyond a handful of numbers per address. Only the previous snapshot of each
+# token is held in memory, for the turnover.
+class DetectionState:
+    def __init__(self, size=0):
+        self.top_hits = np.zeros(size, dtype=np.int32)  # snapshots in which the address is in the top N
+        self.abs_change = np.zeros(size)  # sum of |share change| between consecutive snapshots of a token
+        self.share_sum = np.zeros(size)  # sum of supply shares over all snapshots
+        self.top_pairs = []  # (address id, token index) arrays of top-N memberships
+        self.held = {}  # token id -> sorted ids that ever held the token
+        self.previous = {}  # token id -> (sorted ids, shares) of the previous snapshot
+        self.snapshots = {}  # token id -> number of snapshots
+
+    def grow(self, size):
+        if size > len(self.top_hits):
+            extra = size - len(self.top_hits)
+            self.top_hits = np.concatenate([self.top_hits, np.zeros(extra, dtype=np.int32)])
+            self.abs_change = np.concatenate([self.abs_change, np.zeros(extra)])
+            self.share_sum = np.concatenate([self.share_sum, np.zeros(extra)])
+
+    def add_snapshot(self, token_index, token_id, address_id, balance):
+        total = balance.sum()
+        if not len(address_id) or total <= 0:
+            return
+        self.grow(int(address_id.max()) + 1)
+        # Offset pagination over tied balances can return a holder twice. Summing the rows of each id
+        # makes the ids unique, which the scatters and merge join below rely on; they come out sorted.
+        address_id, inverse = np.unique(address_id, return_inverse=True)
+        balance = np.bincount(inverse, weights=balance, minlength=len(address_id))
+        ids, shares = address_id, balance / total
+        self.snapshots[token_id] = self.snapshots.get(token_id, 0) + 1
+
+        top = address_id[np.argpartition(balance, -TOP_N)[-TOP_N:]] if len(balance) > TOP_N else address_id
+        self.top_hits[top] += 1
+        self.top_pairs.append(np.stack([top, np.full(len(top), token_index, dtype=top.dtype)], axis=1))
+        self.share_sum[ids] += shares  # ids are unique, so fancy-index adds are exact
+        self.held[token_id] = np.union1d(self.held.get(token_id, np.empty(0, dtype=ids.dtype)), ids)
+
+        if token_id in self.previous:
+            previous_ids, previous_shares = self.previous[token_id]
+            _, previous_index, current_index = np.intersect1d(previous_ids, ids, assume_unique=True, return_indices=True)
+            change = shares.copy()
+            change[current_index] = np.abs(shares[current_index] - previous_shares[previous_index])
+            exited = np.ones(len(previous_ids), dtype=bool)
+            exited[previous_index] = False
+            self.abs_change[ids] += change
+            self.abs_change[previous_ids[exited]] += previous_shares[exited]
+        self.previous[token_id] = (ids, shares)
+
+# Burn, null and vanity labels from the address bytes alone
+def match_address_patterns(addresses):
+    labels = np.full(len(addresses), '', dtype=object)
+    raw = np.frombuffer(np.ascontiguousarray(addresses).tobytes(), dtype=np.uint8).reshape(-1, 20)
+    leading_zero_bytes = np.argmax(raw != 0, axis=1)
+    leading_zero_bytes[~raw.any(axis=1)] = 20
+    labels[leading_zero_bytes >= VANITY_ZERO_BYTES] = 'vanity_contract'
+    for k, address in enumerate(addresses):
+        label = BURN_ADDRESSES.get(bytes(address).ljust(20, b'\0'))
+        if label:
+            labels[k] = label
+    return labels
+
+# Combine the statistics of every address that was ever in a top N into scores in [0, 1]
+def score_candidates(state, token_ids):
+    pairs = np.unique(np.concatenate(state.top_pairs), axis=0) if state.top_pairs else np.empty((0, 2), dtype=np.int64)
+    ids, top_tokens = np.unique(pairs[:, 0], return_counts=True)
+
+    # Snapshots in which an address could have been in the top N: all snapshots of its top tokens
+    snapshot_counts = np.array([state.snapshots.get(token_id, 0) for token_id in token_ids])
+    eligible = np.bincount(np.searchsorted(ids, pairs[:, 0]), weights=snapshot_counts[pairs[:, 1]], minlength=len(ids))
+    held_tokens = sum(np.isin(ids, held, assume_unique=True).astype(int) for held in state.held.values())
+
+    token_count = max(len(state.held), 1)
+    turnover = state.abs_change[ids] / state.share_sum[ids]
+    features = {
+        'cross_token_top': (top_tokens - 1) / max(token_count - 1, 1),
+        'top_persistence': state.top_hits[ids] / eligible,
+        'token_breadth': held_tokens / token_count,
+        'turnover': turnover / (1 + turnover)
+    }
+    score = sum(weight * features[feature] for feature, weight in SCORE_WEIGHTS.items())
+    return pd.DataFrame({
+        'address_id': ids,
+        'score': score,
+        'top_tokens': top_tokens,
+        'held_tokens': held_tokens,
+        'top_snapshots': state.top_hits[ids],
+        'top_persistence': features['top_persistence'],
+        'turnover': turnover
+    })
+
+def main():
+    tasks = [task for task in list_snapshot_tasks(os.path.join(PROCESSED_DATA_PATH, "token_holders")) if task[2].endswith('.npz')]
+    token_ids = sorted({token_id for _, token_id, _ in tasks})
+    token_indices = {token_id: k for k, token_id in enumerate(token_ids)}
+    address_index = AddressIndex.load()
+    state = DetectionState(len(address_index))
+
+    # Tasks are in date order, so consecutive snapshots of a token arrive one after the other
+    print(f"Scanning {len(tasks)} snapshots of {len(token_ids)} tokens")
+    truncated = 0
+    for i, (date_folder, token_id, file_path) in enumerate(tasks):
+        try:
+            snapshot = load_snapshot(file_path)
+        except Exception as e:
+            print(f"Error loading file {file_path}: {e}")
+            continue
+        if is_truncated(snapshot):
+            # The missing tail of a top-K snapshot would read as holders exiting, inflating turnover
+            truncated += 1
+            continue
+        state.add_snapshot(token_indices[token_id], token_id, snapshot['address_id'], snapshot['balance'])
+        if i % 50 == 0:
+            print(f"Scanned {i + 1}/{len(tasks)} snapshots")
+
+    if truncated:
+        print(f"Skipped {truncated} top-K snapshots")
+
+    candidates = score_candidates(state, token_ids)
+    address_bytes = address_index.addresses_for(candidates['address_id'].values)
+    candidates.insert(0, 'address', bytes_to_addresses(address_bytes))
+    candidates.insert(1, 'label', match_address_patterns(address_bytes))
+    candidates.loc[candidates['label'] != '', 'score'] = 1.0
+    candidates.loc[candidates['label'] == '', 'label'] = 'exchange_candidate'
+    candidates['known_exchange'] = load_exchange_index().contains(address_bytes)
+
+    candidates = candidates[candidates['score'] >= MIN_CANDIDATE_SCORE].drop(columns='address_id')
+    candidates = candidates.sort_values('score', ascending=False)
+    os.makedirs(os.path.dirname(EXCHANGE_CANDIDATES_PATH), exist_ok=True)
+    candidates.to_csv(EXCHANGE_CANDIDATES_PATH, index=False)
+    print(f"Saved {len(candidates)} candidates ({(~candidates['known_exchange']).sum()} not yet labelled) to {EXCHANGE_CANDIDATES_PATH}")
+
+if __name__ == "__main__":
+    main()
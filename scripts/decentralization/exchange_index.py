@@ -0,0 +1,79 @@
+import os
+import sys
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+
+# Ensure the root directory is in the sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scripts.config import EXCHANGE_ADDRESSES_PATH, EXCHANGE_CANDIDATES_PATH
+from scripts.decentralization.holder_store import ADDRESS_DTYPE, addresses_to_bytes
+
+# Exchange-label index: for every token a sorted array of unique 20-byte addresses, plus a global
+# array over all tokens. Addresses are stored as raw bytes, so hex case no longer matters, and
+# membership tests are a vectorized binary search, O(n log m) for n queried addresses.
+# Detected candidates (see detect_exchange_addresses.py) are not tied to a token and are shared
+# by every token.
+class ExchangeIndex:
+    def __init__(self, by_token, shared=None):
+        self.shared = np.empty(0, dtype=ADDRESS_DTYPE) if shared is None else np.unique(shared)
+        if len(self.shared):
+            by_token = {token_id: np.union1d(addresses, self.shared) for token_id, addresses in by_token.items()}
+        self.by_token = by_token
+        labelled = list(by_token.values()) + [self.shared]
+        self.all_addresses = np.unique(np.concatenate(labelled)) if by_token or len(self.shared) else np.empty(0, dtype=ADDRESS_DTYPE)
+
+    def token_ids(self):
+        return sorted(self.by_token)
+
+    def count(self, token_id=None):
+        return len(self.addresses(token_id))
+
+    def addresses(self, token_id=None):
+        # Sorted exchange addresses of one token, or of all tokens when token_id is None
+        if token_id is None:
+            return self.all_addresses
+        return self.by_token.get(token_id.lower(), self.shared)
+
+    def contains(self, addresses, token_id=None):
+        # Boolean mask of which addresses (S20 array or hex strings) are labelled exchanges
+        if not isinstance(addresses, np.ndarray) or addresses.dtype != ADDRESS_DTYPE:
+            addresses = addresses_to_bytes(addresses)
+        labelled = self.addresses(token_id)
+        if not len(labelled):
+            return np.zeros(len(addresses), dtype=bool)
+        positions = np.searchsorted(labelled, addresses)
+        positions[positions == len(labelled)] = 0
+        return labelled[positions] == addresses
+
+def build_exchange_index(exchange_addresses_df, candidates_df=None, min_score=None):
+    df = exchange_addresses_df.dropna(subset=['id', 'address'])
+    address = df['address'].astype(str).str.strip()
+    valid = address.str.fullmatch(r'0[xX][0-9a-fA-F]{40}')
+    if not valid.all():
+        print(f"Ignoring {(~valid).sum()} malformed exchange addresses")
+
+    token_ids = df['id'].astype(str).str.lower()[valid].values
+    address_bytes = addresses_to_bytes(address[valid])
+    by_token = {token_id: np.unique(address_bytes[token_ids == token_id]) for token_id in np.unique(token_ids)}
+
+    shared = None
+    if candidates_df is not None and min_score is not None:
+        accepted = candidates_df[candidates_df['score'] >= min_score]
+        shared = addresses_to_bytes(accepted['address'])
+        print(f"Adding {len(shared)} detected candidates with a score of at least {min_score} to every token")
+    return ExchangeIndex(by_token, shared)
+
+# Loaded once per process. With min_score set, detected candidates scoring at least min_score
+# are labelled as exchanges of every token. Until detect_exchange_addresses.py has written the
+# candidates, only the curated list is used.
+@lru_cache(maxsize=None)
+def load_exchange_index(path=EXCHANGE_ADDRESSES_PATH, min_score=None, candidates_path=EXCHANGE_CANDIDATES_PATH):
+    candidates_df = None
+    if min_score is not None:
+        if os.path.exists(candidates_path):
+            candidates_df = pd.read_csv(candidates_path)
+        else:
+            print(f"Warning: {candidates_path} not found, run detect_exchange_addresses.py first. Using the curated exchange list only.")
+    return build_exchange_index(pd.read_csv(path), candidates_df, min_score)
@@ -1,159 +1,418 @@
 import os
 import sys
+import argparse
 import requests
 import pandas as pd
+import numpy as np
 import json
-import time
+import threading
+from collections import deque
 from datetime import datetime
-from dateutil.relativedelta import relativedelta
 
 # Ensure the root directory is in the sys.path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from scripts.config import RAW_DATA_PATH, ACCESS_TOKENS, CONSOLIDATED_INDEX_PATH, START_DATE, END_DATE
+from scripts.config import RAW_DATA_PATH, ACCESS_TOKENS, CONSOLIDATED_INDEX_PATH, START_DATE, END_DATE, TOKEN_HOLDERS_LEDGER_PATH, SNAPSHOT_CADENCE
+from scripts.rate_limit import TokenBucket
+from scripts.http_client import client, MAX_RETRIES
+from scripts.decentralization.holder_ledger import HolderLedger, FINISHED_STATES
+from scripts.decentralization.holder_store import NpzHolderSink, get_snapshot_path, mmap_snapshot
+from scripts.decentralization.holder_deltas import RAW_DELTAS_PATH, snapshot_dates
 
 # Configuration settings
 OUTPUT_DIR = os.path.join(RAW_DATA_PATH, "token_holders/")
 API_URL = "https://streaming.bitquery.io/graphql"
-TIMER_DELAY = 10  # Delay in seconds between each API call
+TIMER_DELAY = 10  # Average delay in seconds between API calls on a single API key
+BURST_SIZE = 3  # Number of API calls a key may make back-to-back before being throttled
+WORKERS_PER_KEY = 2  # Number of requests kept in flight per API key
 PAGE_SIZE = 25000  # Maximum number of token holders per request
-RETRY_DELAY = 30  # Delay in seconds before retrying after an error
-MAX_RETRIES = 5  # Maximum number of retries for API calls
 
-# List of API tokens
-api_keys = ACCESS_TOKENS
-current_key_index = 0
+QUERY = """
+query MyQuery($tokenContract: String!, $date: String!, $offset: Int!, $limit: Int!) {
+  EVM(dataset: archive, network: eth) {
+    TokenHolders(
+      date: $date
+      tokenSmartContract: $tokenContract
+      limit: {count: $limit, offset: $offset}
+      orderBy: {descending: Balance_Amount}
+    ) {
+      Holder {
+        Address
+      }
+      Balance {
+        Amount(minimum: Balance_Amount, selectWhere: {gt: "0.000000000000000000"})
+      }
+    }
+  }
+}
+"""
 
-HEADERS = {
-    'Content-Type': 'application/json',
-    'Authorization': f'Bearer {api_keys[current_key_index]}'
+# Number of holders with a positive balance and the supply they hold, used to bound the metrics
+# of snapshots fetched in top-K mode
+TOTALS_QUERY = """
+query MyQuery($tokenContract: String!, $date: String!) {
+  EVM(dataset: archive, network: eth) {
+    TokenHolders(
+      date: $date
+      tokenSmartContract: $tokenContract
+      where: {Balance: {Amount: {gt: "0.000000000000000000"}}}
+    ) {
+      holders: uniq(of: Holder_Address)
+      supply: sum(of: Balance_Amount)
+    }
+  }
 }
+"""
 
-def switch_api_key():
-    global current_key_index, HEADERS
-    current_key_index = (current_key_index + 1) % len(api_keys)
-    HEADERS['Authorization'] = f'Bearer {api_keys[current_key_index]}'
-    print(f"Switched to API key {current_key_index + 1}")
-
-def fetch_token_holders(token_contract, date, offset=0):
-    query = """
-    query MyQuery($tokenContract: String!, $date: String!, $offset: Int!) {
-      EVM(dataset: archive, network: eth) {
-        TokenHolders(
-          date: $date
-          tokenSmartContract: $tokenContract
-          limit: {count: 25000, offset: $offset}
-          orderBy: {descending: Balance_Amount}
-        ) {
-          Holder {
-            Address
-          }
-          Balance {
-            Amount(minimum: Balance_Amount, selectWhere: {gt: "0.000000000000000000"})
-          }
-        }
+# Net balance change of every address that moved tokens after $since up to and including $till,
+# used for the delta snapshots between two monthly anchors
+DELTA_QUERY = """
+query MyQuery($tokenContract: String!, $since: String!, $till: String!, $offset: Int!, $limit: Int!) {
+  EVM(dataset: archive, network: eth) {
+    BalanceUpdates(
+      where: {Currency: {SmartContract: {is: $tokenContract}}, Block: {Date: {after: $since, till: $till}}}
+      limit: {count: $limit, offset: $offset}
+      orderBy: {ascending: BalanceUpdate_Address}
+    ) {
+      BalanceUpdate {
+        Address
       }
+      change: sum(of: BalanceUpdate_Amount)
+    }
+  }
+}
+"""
+
+class KeyExhausted(Exception):
+    # Raised when Bitquery answers 402 (Payment Required) for an API key
+    pass
+
+# One Bitquery API key with its own rate limiter
+class BitqueryKey:
+    def __init__(self, index, api_key):
+        self.index = index
+        self.headers = {
+            'Content-Type': 'application/json',
+            'Authorization': f'Bearer {api_key}'
+        }
+        self.bucket = TokenBucket(rate=1 / TIMER_DELAY, capacity=BURST_SIZE)
+        self.exhausted = threading.Event()
+
+    def __str__(self):
+        return f"API key {self.index + 1}"
+
+# A single (date, token) snapshot to download, page by page. With top_k set only the top_k
+# largest holders are fetched. With previous_date set only the balance changes since that date
+# are fetched, into the delta directory.
+class SnapshotTask:
+    def __init__(self, token_id, token_name, token_contract, date, top_k=None, previous_date=None):
+        self.token_id = token_id
+        self.token_name = token_name
+        self.token_contract = token_contract
+        self.date = date
+        self.date_str = date.strftime("%Y-%m-%d")
+        self.top_k = top_k
+        self.previous_date = previous_date
+        self.offset = 0
+        self.page = 0
+        self.fetched = False
+        self.holder_count = 0
+        if previous_date is None:
+            self.sink = NpzHolderSink(get_snapshot_path(os.path.join(OUTPUT_DIR, self.date_str), token_id))
+        else:
+            self.sink = NpzHolderSink(get_snapshot_path(os.path.join(RAW_DELTAS_PATH, self.date_str), token_id), value_column='change')
+        self.sink_size = 0
+
+    def __str__(self):
+        return f"{self.token_name} on {self.date_str}"
+
+    def page_limit(self):
+        if self.top_k is None:
+            return PAGE_SIZE
+        return min(PAGE_SIZE, self.top_k - self.holder_count)
+
+    def truncated(self):
+        return self.top_k is not None and self.holder_count >= self.top_k
+
+# Work queue shared by all key workers. Tasks handed back by an exhausted key are
+# picked up by the remaining keys with their pagination state intact.
+class SnapshotQueue:
+    def __init__(self, tasks):
+        self.tasks = deque(tasks)
+        self.in_flight = 0
+        self.condition = threading.Condition()
+
+    def get(self):
+        with self.condition:
+            while not self.tasks and self.in_flight:
+                self.condition.wait()
+            if not self.tasks:
+                return None
+            self.in_flight += 1
+            return self.tasks.popleft()
+
+    def done(self, task, requeue=False):
+        with self.condition:
+            self.in_flight -= 1
+            if requeue:
+                self.tasks.appendleft(task)
+            self.condition.notify_all()
+
+# Restore the pagination state of a partially fetched snapshot from its committed pages
+# and cut the part files back to the last committed page
+def resume_task(task, ledger):
+    task.page = task.offset = task.holder_count = task.sink_size = 0
+    task.fetched = False
+    for page, offset, holders, sink_size in ledger.committed_pages(task.date_str, task.token_id):
+        if page != task.page:
+            break
+        task.page = page + 1
+        task.offset = offset + PAGE_SIZE
+        task.holder_count += holders
+        task.sink_size = sink_size
+        task.fetched = holders < PAGE_SIZE or task.truncated()
+
+    opened_size = task.sink.open(task.sink_size)
+    if opened_size != task.sink_size or (task.holder_count and not task.sink_size):
+        # The part files are missing or shorter than the ledger claims, start the snapshot over
+        ledger.reset_pages(task.date_str, task.token_id)
+        task.page = task.offset = task.holder_count = task.sink_size = 0
+        task.fetched = False
+    elif task.page:
+        print(f"Resuming {task} after {task.page} committed pages ({task.holder_count} holders)")
+
+# Send one GraphQL query with the key's rate limiter and return the EVM result, or None once the
+# client has used up its retries. A 429 pauses only this key's limiter, a 402 retires the key.
+def post_query(key, query, variables):
+    payload = {
+        "query": query,
+        "variables": variables
     }
-    """
+
+    try:
+        response = client.post(API_URL, headers=key.headers, data=json.dumps(payload), rate_limiter=key.bucket)
+        if response.status_code == 402:  # Payment Required
+            raise KeyExhausted(str(key))
+        response.raise_for_status()  # Will raise an HTTPError if the HTTP request returned an unsuccessful status code
+        data = response.json()
+
+        return data.get('data', {}).get('EVM', {})
+    except KeyExhausted:
+        raise
+    except requests.exceptions.HTTPError as http_err:
+        print(f"HTTP error occurred: {http_err}")
+    except Exception as err:
+        print(f"An error occurred: {err}")
+
+    return None
+
+def fetch_token_holders(key, token_contract, date, offset=0, limit=PAGE_SIZE):
     variables = {
         "tokenContract": token_contract,
         "date": date,
-        "offset": offset
+        "offset": offset,
+        "limit": limit
     }
-    payload = {
-        "query": query,
-        "variables": variables
+    result = post_query(key, QUERY, variables)
+    if result is None:
+        return None
+    return result.get('TokenHolders', [])
+
+# Balance changes in the same row layout as fetch_token_holders, with the change as the amount
+def fetch_balance_changes(key, token_contract, since, till, offset=0, limit=PAGE_SIZE):
+    variables = {
+        "tokenContract": token_contract,
+        "since": since,
+        "till": till,
+        "offset": offset,
+        "limit": limit
     }
-    
-    retries = 0
-    while retries < MAX_RETRIES:
+    result = post_query(key, DELTA_QUERY, variables)
+    if result is None:
+        return None
+    return [{'Holder': {'Address': row['BalanceUpdate']['Address']}, 'Balance': {'Amount': row['change']}}
+            for row in result.get('BalanceUpdates', [])]
+
+# Returns (holder count, total supply) of a token on a date, or None on failure
+def fetch_token_totals(key, token_contract, date):
+    result = post_query(key, TOTALS_QUERY, {"tokenContract": token_contract, "date": date})
+    if result is None:
+        return None
+    totals = result.get('TokenHolders', [])
+    if not totals:
+        return 0, 0.0
+    return int(totals[0]['holders']), float(totals[0]['supply'])
+
+# Fetch the remaining pages of a snapshot; returns False if the snapshot had to be abandoned.
+# Every page is appended to the snapshot's part files and committed to the ledger before the
+# next one is requested, so only a single page is ever held in memory.
+def fetch_snapshot(key, task, ledger):
+    resume_task(task, ledger)
+    while not task.fetched:
+        print(f"Fetching holders for {task.token_name} ({task.token_contract}) on {task.date_str} with offset {task.offset} using {key}")
+        limit = task.page_limit()
+        if task.previous_date is None:
+            holders = fetch_token_holders(key, task.token_contract, task.date_str, task.offset, limit)
+        else:
+            holders = fetch_balance_changes(key, task.token_contract, task.previous_date.strftime("%Y-%m-%d"), task.date_str, task.offset, limit)
+
+        if holders is None:
+            print(f"Giving up on {task} after {MAX_RETRIES} failed attempts")
+            ledger.mark_failed(task.date_str, task.token_id, task.top_k)
+            return False
+
+        if holders:
+            task.sink_size = task.sink.append(holders)
+        ledger.commit_page(task.date_str, task.token_id, task.page, task.offset, len(holders), task.sink_size, task.top_k)
+        task.holder_count += len(holders)
+        task.page += 1
+        if len(holders) < limit or task.truncated():
+            task.fetched = True
+        else:
+            task.offset += PAGE_SIZE
+
+    metadata = None
+    if task.truncated():
+        # The tail was not fetched, store the totals it is bounded by instead
+        totals = fetch_token_totals(key, task.token_contract, task.date_str)
+        if totals is None:
+            print(f"Giving up on {task} after {MAX_RETRIES} failed attempts to fetch its totals")
+            ledger.mark_failed(task.date_str, task.token_id, task.top_k)
+            return False
+        holder_count, total_supply = totals
+        metadata = {'holder_count': np.int64(max(holder_count, task.holder_count)), 'total_supply': np.float64(total_supply)}
+
+    if task.holder_count or task.previous_date is not None:
+        # Deltas are kept even when empty, every link of a snapshot chain has to exist
+        task.sink.finalize(metadata)
+        print(f"Saved {task.holder_count} token holders for {task.token_id} on {task.date_str} to {task.sink.path}")
+    else:
+        task.sink.discard()
+        print(f"No holders found for {task}")
+    # Snapshots with fewer than K holders are complete, only cut-off ones record their K
+    ledger.mark_complete(task.date_str, task.token_id, task.holder_count, task.top_k if task.truncated() else None)
+    return True
+
+def key_worker(key, work, failed, ledger):
+    while not key.exhausted.is_set():
+        task = work.get()
+        if task is None:
+            return
+        if key.exhausted.is_set():
+            work.done(task, requeue=True)
+            return
+
         try:
-            response = requests.post(API_URL, headers=HEADERS, data=json.dumps(payload))
-            response.raise_for_status()  # Will raise an HTTPError if the HTTP request returned an unsuccessful status code
-            data = response.json()
-            
-            holders = data.get('data', {}).get('EVM', {}).get('TokenHolders', [])
-            return holders
-        except requests.exceptions.HTTPError as http_err:
-            if response.status_code == 402:  # Payment Required
-                print(f"API key {current_key_index + 1} exhausted, switching to the next key.")
-                switch_api_key()
-                retries = 0  # Reset retries after switching keys
-                offset = 0  # Reset offset after switching keys
-            else:
-                print(f"HTTP error occurred: {http_err}")
-        except Exception as err:
-            print(f"An error occurred: {err}")
-        
-        retries += 1
-        print(f"Retrying in {RETRY_DELAY} seconds... (Attempt {retries}/{MAX_RETRIES})")
-        time.sleep(RETRY_DELAY)
-    
-    return []
-
-def save_to_csv(token_id, date, holders):
-    date_str = date.strftime("%Y-%m-%d")
-    date_dir = os.path.join(OUTPUT_DIR, date_str)
-    os.makedirs(date_dir, exist_ok=True)
-    
-    file_path = os.path.join(date_dir, f"{token_id}.csv")
-    
-    df = pd.DataFrame(holders)
-    df.to_csv(file_path, index=False)
-    print(f"Saved token holders for {token_id} on {date_str} to {file_path}")
+            if not fetch_snapshot(key, task, ledger):
+                failed.append(task)
+            work.done(task)
+        except KeyExhausted:
+            print(f"{key} exhausted, handing {task} (offset {task.offset}) to the remaining keys.")
+            key.exhausted.set()
+            work.done(task, requeue=True)
+        except Exception as e:
+            print(f"Error fetching {task}: {e}")
+            failed.append(task)
+            work.done(task)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Fetch monthly token holder snapshots from Bitquery.")
+    parser.add_argument('--top-k', type=int, default=None,
+                        help="Only fetch the K largest holders of each snapshot, plus its holder count and total supply")
+    args = parser.parse_args()
+    if args.top_k is not None and args.top_k < 1:
+        parser.error("--top-k must be at least 1")
+    if args.top_k is not None and SNAPSHOT_CADENCE != 'monthly':
+        parser.error("--top-k cannot be combined with delta snapshots, set SNAPSHOT_CADENCE to 'monthly'")
+    return args
+
+# Number of holders a saved snapshot was cut off at, or None for a full snapshot. Only the zip
+# and .npy headers are read.
+def saved_top_k(path):
+    if not path.endswith('.npz') or not os.path.exists(path):
+        return None
+    snapshot = mmap_snapshot(path)
+    return len(snapshot['address']) if 'holder_count' in snapshot else None
+
+# Whether a snapshot cut off at stored_top_k (None: full) holds what a run with top_k needs
+def covers(stored_top_k, top_k):
+    return stored_top_k is None or (top_k is not None and stored_top_k >= top_k)
 
 def main():
+    args = parse_args()
     os.makedirs(OUTPUT_DIR, exist_ok=True)
-    
+
     consolidated_index_df = pd.read_csv(CONSOLIDATED_INDEX_PATH)
     print(f"Loaded consolidated index file with {len(consolidated_index_df)} entries.")
-    
+
     # Define date ranges
     start_date = datetime.strptime(START_DATE, "%Y-%m-%d")
     end_date = datetime.strptime(END_DATE, "%Y-%m-%d")
-    
-    dates = []
-    current_date = start_date
-    while current_date <= end_date:
-        dates.append(current_date)
-        current_date += relativedelta(months=1)
-    
-    for date in dates:
-        date_str = date.strftime("%Y-%m-%d")
-        print(f"\nProcessing date: {date_str}\n" + "="*50)
-        
+
+    # Monthly anchors, plus the delta dates in between for a finer SNAPSHOT_CADENCE
+    dates = snapshot_dates(start_date, end_date)
+
+    ledger = HolderLedger(TOKEN_HOLDERS_LEDGER_PATH)
+    skipped = 0
+    refetched = 0
+    tasks = []
+    for date, previous_date in dates:
         for i, token in consolidated_index_df.iterrows():
             token_name = token['name']
             token_contract = token['address']
             token_id = token['id']
-            
+
             if pd.isna(token_contract) or token_contract == '':
                 print(f"Skipping {token_name} due to missing contract address.")
             else:
-                all_holders = []
-                offset = 0
-
-                while True:
-                    print(f"Fetching holders for {token_name} ({token_contract}) on {date_str} with offset {offset}")
-                    holders = fetch_token_holders(token_contract, date_str, offset)
-                    
-                    if holders:
-                        all_holders.extend(holders)
-                        if len(holders) < PAGE_SIZE:
-                            break
-                        offset += PAGE_SIZE
-                    else:
-                        print(f"No more holders found for {token_name} on {date_str}")
-                        break
-
-                    time.sleep(TIMER_DELAY)  # Adding a delay between each API call
-
-                if all_holders:
-                    save_to_csv(token_id, date, all_holders)
-                else:
-                    print(f"No holders found for {token_name} on {date_str}")
-        
-        print(f"Completed processing for date: {date_str}")
+                task = SnapshotTask(token_id, token_name, token_contract, date, args.top_k, previous_date)
+                snapshot = ledger.get_snapshot(task.date_str, token_id)
+                saved_files = [task.sink.path]
+                if previous_date is None:
+                    saved_files.append(os.path.join(OUTPUT_DIR, task.date_str, f"{token_id}.csv"))
+                if snapshot is None and any(os.path.exists(path) for path in saved_files):
+                    ledger.register_existing(task.date_str, token_id, top_k=saved_top_k(task.sink.path))
+                    snapshot = ledger.get_snapshot(task.date_str, token_id)
+                if snapshot is not None:
+                    status, holders, stored_top_k = snapshot
+                    if status in FINISHED_STATES and stored_top_k is None:
+                        # Ledgers from before top_k was recorded, read it from the saved snapshot
+                        stored_top_k = saved_top_k(task.sink.path)
+                    if status in FINISHED_STATES and covers(stored_top_k, args.top_k):
+                        skipped += 1
+                        continue
+                    if status in FINISHED_STATES or stored_top_k != args.top_k:
+                        # Fetched in another mode, its pages cannot be resumed by this run
+                        ledger.reset_pages(task.date_str, token_id)
+                        refetched += 1
+                tasks.append(task)
+
+    print(f"Skipping {skipped} snapshots already completed according to {TOKEN_HOLDERS_LEDGER_PATH}.")
+    if refetched:
+        print(f"Refetching {refetched} snapshots started or saved with a different --top-k.")
+
+    # Every key works through the shared queue at the same time, each throttled by its own bucket
+    keys = [BitqueryKey(i, api_key) for i, api_key in enumerate(ACCESS_TOKENS)]
+    work = SnapshotQueue(tasks)
+    failed = []
+    print(f"Snapshot cadence: {SNAPSHOT_CADENCE}, {sum(previous is not None for _, previous in dates)} of {len(dates)} dates stored as deltas.")
+    print(f"Fetching {len(tasks)} snapshots with {len(keys)} API keys and {WORKERS_PER_KEY} workers per key.")
+    if args.top_k:
+        print(f"Top-K mode: keeping the {args.top_k} largest holders of each snapshot.")
+
+    threads = [threading.Thread(target=key_worker, args=(key, work, failed, ledger)) for key in keys for _ in range(WORKERS_PER_KEY)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if work.tasks:
+        print(f"\nAll API keys exhausted, {len(work.tasks)} snapshots left unfetched.")
+    if failed:
+        print(f"\n{len(failed)} snapshots failed: {', '.join(str(task) for task in failed)}")
+    ledger.close()
+    client.print_stats()
+    print("Completed fetching token holders.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,126 @@
+import os
+import sys
+from datetime import datetime
+from dateutil.relativedelta import relativedelta
+import numpy as np
+
+# Ensure the root directory is in the sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scripts.config import RAW_DATA_PATH, PROCESSED_DATA_PATH, SNAPSHOT_CADENCE
+from scripts.decentralization.holder_store import get_snapshot_path, load_snapshot
+
+# Snapshots finer than monthly are stored as deltas. Every month starts with a full anchor
+# snapshot in token_holders/, every later date of the month only stores the addresses whose
+# balance changed since the previous date, in token_holder_deltas/:
+#   raw:       address (S20), change (float64)
+#   processed: address_id (int32), change (float64), is_exchange (bool)
+# A full snapshot is rebuilt from its month's anchor plus all deltas up to its date.
+RAW_ANCHORS_PATH = os.path.join(RAW_DATA_PATH, "token_holders/")
+RAW_DELTAS_PATH = os.path.join(RAW_DATA_PATH, "token_holder_deltas/")
+PROCESSED_ANCHORS_PATH = os.path.join(PROCESSED_DATA_PATH, "token_holders/")
+PROCESSED_DELTAS_PATH = os.path.join(PROCESSED_DATA_PATH, "token_holder_deltas/")
+
+CADENCE_STEPS = {
+    'monthly': None,
+    'weekly': relativedelta(weeks=1),
+    'daily': relativedelta(days=1),
+}
+DUST_TOLERANCE = 1e-9  # Rebuilt balances below this share of the summed changes are rounding noise
+
+# All snapshot dates between start and end as (date, previous date) pairs. The previous date is
+# None for the monthly anchors, which are fetched in full.
+def snapshot_dates(start_date, end_date, cadence=SNAPSHOT_CADENCE):
+    if cadence not in CADENCE_STEPS:
+        raise ValueError(f"Unknown snapshot cadence {cadence!r}, expected one of {', '.join(CADENCE_STEPS)}")
+    step = CADENCE_STEPS[cadence]
+    dates = []
+    anchor = start_date
+    while anchor <= end_date:
+        next_anchor = anchor + relativedelta(months=1)
+        dates.append((anchor, None))
+        current = anchor
+        while step is not None and current + step < next_anchor and current + step <= end_date:
+            dates.append((current + step, current))
+            current += step
+        anchor = next_anchor
+    return dates
+
+# Files needed to rebuild the snapshot of a token on a date: its anchor followed by its deltas.
+# Raises FileNotFoundError when the anchor or any delta in between is missing.
+def snapshot_chain(token_id, date, anchors_path, deltas_path, cadence=SNAPSHOT_CADENCE):
+    date = datetime.strptime(date, "%Y-%m-%d")
+    anchors = [datetime.strptime(folder, "%Y-%m-%d") for folder in os.listdir(anchors_path)
+               if os.path.exists(get_snapshot_path(os.path.join(anchors_path, folder), token_id))]
+    anchors = [anchor for anchor in anchors if anchor <= date]
+    if not anchors:
+        raise FileNotFoundError(f"No anchor snapshot of {token_id} on or before {date:%Y-%m-%d}")
+
+    anchor = max(anchors)
+    chain = [get_snapshot_path(os.path.join(anchors_path, f"{anchor:%Y-%m-%d}"), token_id)]
+    step = CADENCE_STEPS[cadence]
+    current = anchor
+    while step is not None and current + step <= date:
+        current += step
+        path = get_snapshot_path(os.path.join(deltas_path, f"{current:%Y-%m-%d}"), token_id)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Missing delta {path} needed for {token_id} on {date:%Y-%m-%d}")
+        chain.append(path)
+    if current != date:
+        raise FileNotFoundError(f"{date:%Y-%m-%d} is not a {cadence} snapshot date of {token_id}")
+    return chain
+
+# Sum an anchor and its deltas per key in one sort. Returns the keys still holding a balance,
+# their balances and, for every kept key, the index of its latest row in the concatenated input.
+def apply_deltas(keys, balances):
+    keys, balances = np.concatenate(keys), np.concatenate(balances)
+    # Reversed, so that return_index points at the latest row of every key
+    unique_keys, latest, inverse = np.unique(keys[::-1], return_index=True, return_inverse=True)
+    inverse = inverse.ravel()
+    totals = np.bincount(inverse, weights=balances[::-1], minlength=len(unique_keys))
+    magnitude = np.bincount(inverse, weights=np.abs(balances[::-1]), minlength=len(unique_keys))
+    kept = totals > DUST_TOLERANCE * magnitude
+    return unique_keys[kept], totals[kept], len(keys) - 1 - latest[kept]
+
+def _largest_first(columns, balance_column):
+    order = np.argsort(-columns[balance_column], kind='stable')
+    return {name: column[order] for name, column in columns.items()}
+
+# Full raw snapshot of a token on any snapshot date, as {'address', 'balance'} sorted by balance
+def reconstruct_raw_snapshot(token_id, date, cadence=SNAPSHOT_CADENCE):
+    chain = [load_snapshot(path) for path in snapshot_chain(token_id, date, RAW_ANCHORS_PATH, RAW_DELTAS_PATH, cadence)]
+    address, balance, _ = apply_deltas([part['address'] for part in chain],
+                                       [chain[0]['balance']] + [part['change'] for part in chain[1:]])
+    return _largest_first({'address': address, 'balance': balance}, 'balance')
+
+# Full processed snapshot of a token on any snapshot date, in the processed snapshot layout. The
+# exchange flag of every address is taken from its latest row.
+def reconstruct_processed_snapshot(token_id, date, cadence=SNAPSHOT_CADENCE):
+    chain = [load_snapshot(path) for path in snapshot_chain(token_id, date, PROCESSED_ANCHORS_PATH, PROCESSED_DELTAS_PATH, cadence)]
+    address_id, balance, latest = apply_deltas([part['address_id'] for part in chain],
+                                               [chain[0]['balance']] + [part['change'] for part in chain[1:]])
+    is_exchange = np.concatenate([part['is_exchange'] for part in chain])[latest]
+    snapshot = _largest_first({'address_id': address_id, 'balance': balance, 'is_exchange': is_exchange}, 'balance')
+    snapshot['id_position'] = np.argsort(snapshot['address_id'], kind='stable')
+    snapshot['id_sorted'] = snapshot['address_id'][snapshot['id_position']]
+    return snapshot
+
+def is_delta_path(file_path):
+    return os.path.abspath(file_path).startswith(os.path.abspath(PROCESSED_DELTAS_PATH))
+
+def _date_and_token(file_path):
+    return os.path.basename(os.path.dirname(file_path)), os.path.splitext(os.path.basename(file_path))[0]
+
+# Files a processed snapshot depends on, for cache keys: the snapshot itself, or a delta's chain
+def processed_snapshot_files(file_path, cadence=SNAPSHOT_CADENCE):
+    if not is_delta_path(file_path):
+        return [file_path]
+    date, token_id = _date_and_token(file_path)
+    return snapshot_chain(token_id, date, PROCESSED_ANCHORS_PATH, PROCESSED_DELTAS_PATH, cadence)
+
+# Load a processed anchor as is, or rebuild the full snapshot of a processed delta
+def load_processed_snapshot(file_path, cadence=SNAPSHOT_CADENCE):
+    if not is_delta_path(file_path):
+        return load_snapshot(file_path)
+    date, token_id = _date_and_token(file_path)
+    return reconstruct_processed_snapshot(token_id, date, cadence)
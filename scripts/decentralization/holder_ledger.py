@@ -0,0 +1,124 @@
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+# Persistent work ledger for the token holder backfill. One row per (date, token) snapshot
+# and one row per committed page, so interrupted runs resume where they stopped. top_k is the
+# number of largest holders a snapshot was cut off at in top-K mode, NULL for full snapshots.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    date TEXT NOT NULL,
+    token_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    pages INTEGER NOT NULL DEFAULT 0,
+    holders INTEGER NOT NULL DEFAULT 0,
+    updated_at TEXT NOT NULL,
+    top_k INTEGER,
+    PRIMARY KEY (date, token_id)
+);
+CREATE TABLE IF NOT EXISTS pages (
+    date TEXT NOT NULL,
+    token_id TEXT NOT NULL,
+    page INTEGER NOT NULL,
+    page_offset INTEGER NOT NULL,
+    holders INTEGER NOT NULL,
+    sink_size INTEGER NOT NULL DEFAULT 0,
+    committed_at TEXT NOT NULL,
+    PRIMARY KEY (date, token_id, page)
+);
+"""
+
+# Snapshot states
+PARTIAL = 'partial'
+FAILED = 'failed'
+COMPLETE = 'complete'
+EMPTY = 'empty'
+FINISHED_STATES = (COMPLETE, EMPTY)
+
+def _now():
+    return datetime.now(timezone.utc).isoformat(timespec='seconds')
+
+class HolderLedger:
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript(SCHEMA)
+        # Ledgers created before pages were streamed to disk lack the sink size column
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(pages)")]
+        if 'sink_size' not in columns:
+            self.connection.execute("ALTER TABLE pages ADD COLUMN sink_size INTEGER NOT NULL DEFAULT 0")
+        # Ledgers created before top-K mode lack the top_k column
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(snapshots)")]
+        if 'top_k' not in columns:
+            self.connection.execute("ALTER TABLE snapshots ADD COLUMN top_k INTEGER")
+        self.lock = threading.Lock()
+
+    def close(self):
+        self.connection.close()
+
+    def _set_status(self, date, token_id, status, holders=None, top_k=None):
+        self.connection.execute(
+            """
+            INSERT INTO snapshots (date, token_id, status, pages, holders, updated_at, top_k)
+            VALUES (?, ?, ?, (SELECT COUNT(*) FROM pages WHERE date = ? AND token_id = ?), COALESCE(?, 0), ?, ?)
+            ON CONFLICT (date, token_id) DO UPDATE SET
+                status = excluded.status,
+                pages = excluded.pages,
+                holders = COALESCE(?, snapshots.holders),
+                updated_at = excluded.updated_at,
+                top_k = excluded.top_k
+            """,
+            (date, token_id, status, date, token_id, holders, _now(), top_k, holders)
+        )
+
+    def get_status(self, date, token_id):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT status FROM snapshots WHERE date = ? AND token_id = ?", (date, token_id)
+            ).fetchone()
+        return row[0] if row else None
+
+    def get_snapshot(self, date, token_id):
+        # Returns (status, holders, top_k), or None for a snapshot that was never started
+        with self.lock:
+            return self.connection.execute(
+                "SELECT status, holders, top_k FROM snapshots WHERE date = ? AND token_id = ?", (date, token_id)
+            ).fetchone()
+
+    def committed_pages(self, date, token_id):
+        # Returns (page, offset, holders, sink_size) tuples of every committed page, in page order
+        with self.lock:
+            return self.connection.execute(
+                "SELECT page, page_offset, holders, sink_size FROM pages WHERE date = ? AND token_id = ? ORDER BY page",
+                (date, token_id)
+            ).fetchall()
+
+    def commit_page(self, date, token_id, page, offset, holders, sink_size, top_k=None):
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO pages (date, token_id, page, page_offset, holders, sink_size, committed_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (date, token_id, page, offset, holders, sink_size, _now())
+            )
+            self._set_status(date, token_id, PARTIAL, top_k=top_k)
+
+    def reset_pages(self, date, token_id, from_page=0):
+        # Forget committed pages that can no longer be trusted, e.g. when the part file is gone
+        with self.lock, self.connection:
+            self.connection.execute(
+                "DELETE FROM pages WHERE date = ? AND token_id = ? AND page >= ?", (date, token_id, from_page)
+            )
+
+    def mark_failed(self, date, token_id, top_k=None):
+        with self.lock, self.connection:
+            self._set_status(date, token_id, FAILED, top_k=top_k)
+
+    def mark_complete(self, date, token_id, holders, top_k=None):
+        # top_k is only recorded for snapshots that were actually cut off
+        with self.lock, self.connection:
+            self._set_status(date, token_id, COMPLETE if holders else EMPTY, holders, top_k)
+
+    def register_existing(self, date, token_id, holders=None, top_k=None):
+        # Record a snapshot that was saved before the ledger existed
+        with self.lock, self.connection:
+            self._set_status(date, token_id, COMPLETE, holders, top_k)
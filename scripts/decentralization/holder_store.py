@@ -0,0 +1,183 @@
+import os
+import hashlib
+import struct
+import zipfile
+import numpy as np
+
+# Token holder snapshots are stored as uncompressed NumPy .npz archives. Raw snapshots have
+#   address: 20-byte Ethereum addresses (dtype S20)
+#   balance: token balances (float64)
+# Processed snapshots replace the address column with an address_id into the global address
+# index (int32) and add an is_exchange mask (bool). Their rows are sorted by balance, largest
+# first, and two more columns index them by address id:
+#   id_sorted:   the address ids in ascending order (int32)
+#   id_position: the row of each entry of id_sorted (int64)
+# Snapshots fetched in top-K mode only hold the largest holders and carry two extra scalars,
+#   total_supply: sum of all positive balances on that date (float64)
+#   holder_count: number of holders with a positive balance on that date (int64)
+# from which the metrics of the missing tail are bounded.
+# Uncompressed archives load without any parsing and can be memory-mapped with mmap_snapshot.
+SNAPSHOT_EXTENSION = ".npz"
+ADDRESS_DTYPE = np.dtype('S20')
+BALANCE_DTYPE = np.dtype('<f8')
+TRUNCATION_FIELDS = ('total_supply', 'holder_count')
+
+def addresses_to_bytes(addresses):
+    # Convert '0x'-prefixed hex strings (any case) to a S20 array in a single C-level decode
+    addresses = list(addresses)
+    if not addresses:
+        return np.empty(0, dtype=ADDRESS_DTYPE)
+    raw = bytes.fromhex(''.join(addresses).replace('0x', '').replace('0X', ''))
+    if len(raw) != 20 * len(addresses):
+        raise ValueError("Addresses must be 20-byte hex strings")
+    return np.frombuffer(raw, dtype=ADDRESS_DTYPE)
+
+def bytes_to_addresses(address_bytes):
+    # Convert a S20 array back to lowercase '0x'-prefixed hex strings
+    address_bytes = np.ascontiguousarray(address_bytes, dtype=ADDRESS_DTYPE)
+    hex_digits = np.frombuffer(address_bytes.tobytes().hex().encode('ascii'), dtype='S40')
+    return np.char.add('0x', hex_digits.astype('U40'))
+
+def get_snapshot_path(directory, token_id):
+    return os.path.join(directory, token_id + SNAPSHOT_EXTENSION)
+
+def list_snapshots(directory):
+    # Map token id -> snapshot file name, preferring .npz over legacy .csv files
+    snapshots = {}
+    for filename in sorted(os.listdir(directory)):
+        token_id, extension = os.path.splitext(filename)
+        if extension == SNAPSHOT_EXTENSION or (extension == '.csv' and token_id not in snapshots):
+            snapshots[token_id] = filename
+    return snapshots
+
+def save_snapshot(path, **columns):
+    # Write the columns to a temporary file and atomically move it into place
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **columns)
+    os.replace(tmp_path, path)
+
+def load_snapshot(path):
+    with np.load(path, allow_pickle=False) as data:
+        return {name: data[name] for name in data.files}
+
+def is_truncated(snapshot):
+    # Top-K snapshots lack the tail of small holders, so their holder sets cannot be compared
+    return 'holder_count' in snapshot
+
+# Open every member of an uncompressed .npz as a read-only memory map. Nothing but the zip and
+# .npy headers is read, pages of the columns are only loaded when they are accessed.
+def mmap_snapshot(path):
+    columns = {}
+    with zipfile.ZipFile(path) as archive, open(path, 'rb') as f:
+        for info in archive.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError(f"{path} member {info.filename} is compressed and cannot be memory-mapped")
+            # The member data follows its local file header, whose name and extra fields vary in length
+            f.seek(info.header_offset)
+            name_length, extra_length = struct.unpack('<HH', f.read(30)[26:30])
+            f.seek(info.header_offset + 30 + name_length + extra_length)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+
+            name = info.filename[:-len('.npy')]
+            count = int(np.prod(shape))
+            if not shape or not count:
+                # Scalars and empty columns are read directly, mmap cannot map zero bytes
+                columns[name] = np.frombuffer(f.read(count * dtype.itemsize), dtype=dtype).reshape(shape)
+            else:
+                columns[name] = np.memmap(path, dtype=dtype, mode='r', offset=f.tell(), shape=shape,
+                                          order='F' if fortran_order else 'C')
+    return columns
+
+# SHA-1 of a snapshot's columns (names, dtypes, shapes and values). np.savez stamps the write time
+# into the zip headers, so the file bytes change whenever unchanged data is rewritten; this hash
+# does not. Files other than .npz archives are hashed byte by byte.
+def hash_snapshot_content(path, chunk_size=1 << 20):
+    digest = hashlib.sha1()
+    if path.endswith(SNAPSHOT_EXTENSION):
+        for name, column in sorted(mmap_snapshot(path).items()):
+            digest.update(f"{name}:{column.dtype.str}:{column.shape};".encode())
+            flat = np.ascontiguousarray(column).reshape(-1).view(np.uint8)
+            for start in range(0, len(flat), chunk_size):
+                digest.update(flat[start:start + chunk_size])
+    else:
+        with open(path, 'rb') as f:
+            while chunk := f.read(chunk_size):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+def _write_npy_member(archive, name, dtype, rows, part_path, chunk_size=1 << 24):
+    # Stream a raw part file into the archive as a .npy member without loading it into memory
+    with archive.open(name + '.npy', 'w', force_zip64=True) as member:
+        header = {'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False, 'shape': (rows,)}
+        np.lib.format.write_array_header_1_0(member, header)
+        with open(part_path, 'rb') as part:
+            while chunk := part.read(chunk_size):
+                member.write(chunk)
+
+# On-disk sink for a snapshot that is written page by page. Each column is appended to its own
+# raw part file as pages arrive; once the snapshot is complete the part files are streamed into
+# the .npz archive, which is atomically renamed into place. Sizes are counted in rows.
+# value_column names the amount column in the archive, 'change' for delta snapshots.
+class NpzHolderSink:
+    def __init__(self, path, value_column='balance'):
+        self.path = path
+        self.value_column = value_column
+        self.part_paths = {
+            'address': path + ".address.part",
+            'balance': path + ".balance.part",
+        }
+        self.itemsizes = {'address': ADDRESS_DTYPE.itemsize, 'balance': BALANCE_DTYPE.itemsize}
+
+    def _part_rows(self):
+        rows = []
+        for column, part_path in self.part_paths.items():
+            if not os.path.exists(part_path):
+                return 0
+            rows.append(os.path.getsize(part_path) // self.itemsizes[column])
+        return min(rows)
+
+    def open(self, committed_size=0):
+        # Start new part files, or cut existing ones back to the last committed row count
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        resume = committed_size and self._part_rows() >= committed_size
+        for column, part_path in self.part_paths.items():
+            with open(part_path, 'r+b' if resume else 'wb') as f:
+                f.truncate(committed_size * self.itemsizes[column] if resume else 0)
+        return committed_size if resume else 0
+
+    def append(self, holders):
+        # Append one page and return the committed row count once it is safely on disk
+        columns = {
+            'address': addresses_to_bytes(holder['Holder']['Address'] for holder in holders),
+            'balance': np.array([holder['Balance']['Amount'] for holder in holders], dtype=BALANCE_DTYPE),
+        }
+        for column, part_path in self.part_paths.items():
+            with open(part_path, 'ab') as f:
+                f.write(columns[column].tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+        return self._part_rows()
+
+    def finalize(self, metadata=None):
+        # metadata: optional scalars stored next to the columns, e.g. the truncation fields
+        rows = self._part_rows()
+        tmp_path = self.path + ".tmp"
+        with zipfile.ZipFile(tmp_path, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+            _write_npy_member(archive, 'address', ADDRESS_DTYPE, rows, self.part_paths['address'])
+            _write_npy_member(archive, self.value_column, BALANCE_DTYPE, rows, self.part_paths['balance'])
+            for name, value in (metadata or {}).items():
+                with archive.open(name + '.npy', 'w') as member:
+                    np.lib.format.write_array(member, np.asarray(value), allow_pickle=False)
+        os.replace(tmp_path, self.path)
+        self.discard()
+
+    def discard(self):
+        for part_path in self.part_paths.values():
+            if os.path.exists(part_path):
+                os.remove(part_path)
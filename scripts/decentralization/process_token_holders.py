@@ -1,64 +1,134 @@
 import os
 import sys
+import argparse
 import pandas as pd
+import numpy as np
 import json
+import re
+import binascii
 
 # Ensure the root directory is in the sys.path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from scripts.config import RAW_DATA_PATH, PROCESSED_DATA_PATH, EXCHANGE_ADDRESSES_PATH
+from scripts.config import RAW_DATA_PATH, PROCESSED_DATA_PATH
+from scripts.decentralization.holder_store import ADDRESS_DTYPE, BALANCE_DTYPE, TRUNCATION_FIELDS, addresses_to_bytes, get_snapshot_path, list_snapshots, load_snapshot, save_snapshot
+from scripts.decentralization.exchange_index import load_exchange_index
+from scripts.decentralization.address_index import AddressIndex
+from scripts.decentralization.holder_deltas import RAW_DELTAS_PATH, PROCESSED_DELTAS_PATH
 
-def load_exchange_addresses():
-    exchange_addresses = pd.read_csv(EXCHANGE_ADDRESSES_PATH)
-    exchange_dict = {}
-    for i, row in exchange_addresses.iterrows():
-        token_id = row['id']
-        address = row['address']
-        if token_id not in exchange_dict:
-            exchange_dict[token_id] = set()
-        exchange_dict[token_id].add(address)
-    return exchange_dict
+ADDRESS_PATTERN = re.compile(rb"'Address': '0x([0-9a-fA-F]{40})'")
+AMOUNT_PATTERN = re.compile(rb"'Amount': '([^']*)'")
 
-def process_token_data(token_id, exchange_addresses, date, token_file, filter_exchanges):
+# Original row-by-row parser, used when a file does not match the expected raw layout
+def parse_raw_holder_csv_rows(input_file_path):
+    df = pd.read_csv(input_file_path)
+    # Normalize JSON-like columns and extract Address and Amount
+    addresses = df['Holder'].apply(lambda x: json.loads(x.replace("'", '"'))['Address'])
+    amounts = df['Balance'].apply(lambda x: json.loads(x.replace("'", '"'))['Amount']).astype(float)
+    return addresses_to_bytes(addresses), amounts.values
+
+# Parse a raw CSV snapshot whose Holder/Balance columns hold Python-repr dicts. Both fields are
+# pulled out of the raw file bytes with one C-level regex scan each, then hex-decoded and
+# converted to float in bulk, instead of decoding two dicts per row.
+def parse_raw_holder_csv(input_file_path):
+    with open(input_file_path, 'rb') as f:
+        body = f.read().partition(b'\n')[2]
+    rows = body.count(b'\n') + (1 if body and not body.endswith(b'\n') else 0)
+
+    addresses = ADDRESS_PATTERN.findall(body)
+    amounts = AMOUNT_PATTERN.findall(body)
+    if len(addresses) != rows or len(amounts) != rows:
+        return parse_raw_holder_csv_rows(input_file_path)
+
+    address = np.frombuffer(binascii.unhexlify(b''.join(addresses)), dtype=ADDRESS_DTYPE)
+    return address, np.array(amounts, dtype=float)
+
+# Load a raw snapshot as (address, balance, truncation fields), from either the binary or the
+# legacy CSV layout. The truncation fields are only present for top-K snapshots.
+def load_raw_snapshot(input_file_path):
+    if input_file_path.endswith('.npz'):
+        snapshot = load_snapshot(input_file_path)
+        truncation = {name: snapshot[name] for name in TRUNCATION_FIELDS if name in snapshot}
+        return snapshot['address'], snapshot['balance'], truncation
+    address, balance = parse_raw_holder_csv(input_file_path)
+    return address, balance, {}
+
+# Parse a raw snapshot once and store it with an exchange mask, from which both the
+# filtered and the unfiltered metrics are derived
+def process_token_data(token_id, exchange_index, address_index, date, token_file):
     input_file_path = os.path.join(RAW_DATA_PATH, "token_holders", date, token_file)
-    output_dir = os.path.join(PROCESSED_DATA_PATH, "token_holders", "filtered" if filter_exchanges else "unfiltered", date)
+    output_dir = os.path.join(PROCESSED_DATA_PATH, "token_holders", date)
     os.makedirs(output_dir, exist_ok=True)
 
     try:
-        df = pd.read_csv(input_file_path)
-        # Normalize JSON-like columns and extract Address and Amount
-        df['Address'] = df['Holder'].apply(lambda x: json.loads(x.replace("'", '"'))['Address'])
-        df['Amount'] = df['Balance'].apply(lambda x: json.loads(x.replace("'", '"'))['Amount']).astype(float)
-        
-        if filter_exchanges:
-            df = df[~df['Address'].isin(exchange_addresses.get(token_id, set()))]
-        
-        # Select only the Address and Amount columns for output
-        df_cleaned = df[['Address', 'Amount']]
-        
-        output_file_path = os.path.join(output_dir, token_id + '.csv')
-        df_cleaned.to_csv(output_file_path, index=False)
+        address, balance, truncation = load_raw_snapshot(input_file_path)
+
+        # Largest holders first, so the top k of a snapshot are its first k rows
+        balance = np.asarray(balance, dtype=BALANCE_DTYPE)
+        order = np.argsort(-balance, kind='stable')
+        address, balance = address[order], balance[order]
+
+        is_exchange = exchange_index.contains(address, token_id)
+        address_id = address_index.intern(address)
+        id_position = np.argsort(address_id, kind='stable')
+
+        output_file_path = get_snapshot_path(output_dir, token_id)
+        save_snapshot(output_file_path, address_id=address_id, balance=balance, is_exchange=is_exchange,
+                      id_sorted=address_id[id_position], id_position=id_position, **truncation)
         print(f"Processed and saved file: {output_file_path}")
     except Exception as e:
         print(f"Error processing file {input_file_path}: {e}")
 
+# Convert a raw delta snapshot into address ids with an exchange mask, keeping only the changes
+def process_token_delta(token_id, exchange_index, address_index, date, token_file):
+    input_file_path = os.path.join(RAW_DELTAS_PATH, date, token_file)
+    output_dir = os.path.join(PROCESSED_DELTAS_PATH, date)
+    os.makedirs(output_dir, exist_ok=True)
+
+    try:
+        delta = load_snapshot(input_file_path)
+        address, change = delta['address'], np.asarray(delta['change'], dtype=BALANCE_DTYPE)
+        output_file_path = get_snapshot_path(output_dir, token_id)
+        save_snapshot(output_file_path, address_id=address_index.intern(address), change=change,
+                      is_exchange=exchange_index.contains(address, token_id))
+        print(f"Processed and saved delta: {output_file_path}")
+    except Exception as e:
+        print(f"Error processing delta {input_file_path}: {e}")
+
+def list_date_folders(path):
+    if not os.path.isdir(path):
+        return []
+    return [f for f in os.listdir(path) if os.path.isdir(os.path.join(path, f))]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Convert raw token holder snapshots and mark exchange addresses.")
+    parser.add_argument('--candidate-min-score', type=float, default=None,
+                        help="Also mark detected exchange candidates with at least this score (see detect_exchange_addresses.py)")
+    return parser.parse_args()
+
 def main():
-    exchange_addresses = load_exchange_addresses()
-    
-    for date_folder in os.listdir(os.path.join(RAW_DATA_PATH, "token_holders")):
-        date_folder_path = os.path.join(RAW_DATA_PATH, "token_holders", date_folder)
-        if os.path.isdir(date_folder_path):
-            print(f"Processing date folder: {date_folder}")
-            for filename in os.listdir(date_folder_path):
-                if filename.endswith('.csv'):
-                    token_id = filename.replace('.csv', '')
-                    try:
-                        # Process with filtering
-                        process_token_data(token_id, exchange_addresses, date_folder, filename, filter_exchanges=True)
-                        # Process without filtering
-                        process_token_data(token_id, exchange_addresses, date_folder, filename, filter_exchanges=False)
-                    except Exception as e:
-                        print(f"Error processing file {date_folder_path}/{filename}: {e}")
+    args = parse_args()
+    exchange_index = load_exchange_index(min_score=args.candidate_min_score)
+    address_index = AddressIndex.load()
+    print(f"Loaded address index with {len(address_index)} addresses.")
+
+    # Dates are processed in order so that address ids are assigned chronologically. Full snapshots
+    # and deltas share one timeline, on a given date there is only one or the other.
+    anchors_path = os.path.join(RAW_DATA_PATH, "token_holders")
+    folders = [(date_folder, anchors_path, process_token_data) for date_folder in list_date_folders(anchors_path)]
+    folders += [(date_folder, RAW_DELTAS_PATH, process_token_delta) for date_folder in list_date_folders(RAW_DELTAS_PATH)]
+    for date_folder, root, process in sorted(folders, key=lambda folder: folder[0]):
+        date_folder_path = os.path.join(root, date_folder)
+        print(f"Processing date folder: {date_folder_path}")
+        for token_id, filename in list_snapshots(date_folder_path).items():
+            try:
+                process(token_id, exchange_index, address_index, date_folder, filename)
+            except Exception as e:
+                print(f"Error processing file {date_folder_path}/{filename}: {e}")
+        # Persist new ids before the snapshots referring to them are relied upon
+        address_index.save()
+
+    print(f"Address index now holds {len(address_index)} addresses.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
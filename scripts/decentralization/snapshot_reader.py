@@ -0,0 +1,90 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+# Ensure the root directory is in the sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scripts.config import PROCESSED_TOKEN_HOLDERS_PATH
+from scripts.decentralization.holder_store import get_snapshot_path, mmap_snapshot, bytes_to_addresses
+from scripts.decentralization.address_index import AddressIndex
+from scripts.decentralization.holder_deltas import PROCESSED_DELTAS_PATH, reconstruct_processed_snapshot
+
+# Random access to processed holder snapshots without loading them. Snapshots and the address
+# index are memory-mapped on first use, so a lookup only touches the pages of a binary search:
+#   get_balance(token_id, date, address)  balance of one address, 0.0 if it holds nothing
+#   top_holders(token_id, date, k)        the k largest holders as a DataFrame
+#   balance_history(token_id, address)    the balance of one address on every snapshot date
+# Dates stored as deltas are rebuilt in memory on first access.
+class SnapshotReader:
+    def __init__(self, token_holders_path=PROCESSED_TOKEN_HOLDERS_PATH, address_index=None):
+        self.token_holders_path = token_holders_path
+        self.address_index = AddressIndex.load(mmap=True) if address_index is None else address_index
+        self.snapshots = {}
+
+    def snapshot(self, token_id, date):
+        key = (token_id, date)
+        if key not in self.snapshots:
+            path = get_snapshot_path(os.path.join(self.token_holders_path, date), token_id)
+            if os.path.exists(path):
+                snapshot = mmap_snapshot(path)
+            elif os.path.exists(get_snapshot_path(os.path.join(PROCESSED_DELTAS_PATH, date), token_id)):
+                snapshot = reconstruct_processed_snapshot(token_id, date)
+            else:
+                raise FileNotFoundError(f"No processed snapshot of {token_id} on {date}")
+            if 'id_sorted' not in snapshot:
+                # Processed before snapshots were stored sorted, build the layout in memory
+                order = np.argsort(-snapshot['balance'], kind='stable')
+                snapshot = {name: column[order] if column.shape else column for name, column in snapshot.items()}
+                snapshot['id_position'] = np.argsort(snapshot['address_id'], kind='stable')
+                snapshot['id_sorted'] = snapshot['address_id'][snapshot['id_position']]
+            self.snapshots[key] = snapshot
+        return self.snapshots[key]
+
+    def dates(self, token_id):
+        dates = []
+        for root in (self.token_holders_path, PROCESSED_DELTAS_PATH):
+            if os.path.isdir(root):
+                dates += [date for date in os.listdir(root) if os.path.exists(get_snapshot_path(os.path.join(root, date), token_id))]
+        return sorted(dates)
+
+    def _address_id(self, address):
+        return int(self.address_index.lookup([address])[0])
+
+    def _balance(self, snapshot, address_id):
+        id_sorted = snapshot['id_sorted']
+        position = np.searchsorted(id_sorted, address_id)
+        if position < len(id_sorted) and id_sorted[position] == address_id:
+            return float(snapshot['balance'][snapshot['id_position'][position]])
+        return 0.0
+
+    def get_balance(self, token_id, date, address):
+        address_id = self._address_id(address)
+        if address_id < 0:
+            return 0.0
+        return self._balance(self.snapshot(token_id, date), address_id)
+
+    def top_holders(self, token_id, date, k=100, filter_exchanges=False):
+        snapshot = self.snapshot(token_id, date)
+        rows = np.arange(min(k, len(snapshot['balance'])))
+        if filter_exchanges:
+            # Rows are sorted by balance, so the first k non-exchange rows are the answer. The mask
+            # is scanned in growing blocks so only its head is read.
+            is_exchange, end = snapshot['is_exchange'], max(2 * k, 1024)
+            while True:
+                rows = np.flatnonzero(~np.asarray(is_exchange[:end]))[:k]
+                if len(rows) == k or end >= len(is_exchange):
+                    break
+                end *= 4
+        address_id = np.asarray(snapshot['address_id'][rows])
+        return pd.DataFrame({
+            'address': bytes_to_addresses(self.address_index.addresses_for(address_id)),
+            'balance': np.asarray(snapshot['balance'][rows]),
+            'is_exchange': np.asarray(snapshot['is_exchange'][rows])
+        })
+
+    def balance_history(self, token_id, address):
+        address_id = self._address_id(address)
+        return [(date, self._balance(self.snapshot(token_id, date), address_id) if address_id >= 0 else 0.0)
+                for date in self.dates(token_id)]
@@ -0,0 +1,121 @@
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Connection and retry settings shared by every fetcher
+POOL_SIZE = 16  # Keep-alive connections kept open per host
+HOST_CONCURRENCY = {  # Maximum number of requests in flight per host
+    'hub.snapshot.org': 4,
+    'streaming.bitquery.io': 16,
+    'pro-api.coingecko.com': 2,
+}
+DEFAULT_CONCURRENCY = 4  # For hosts not listed above
+MAX_RETRIES = 5  # Maximum number of retries of a request
+BACKOFF_BASE = 2  # Delay in seconds before the first retry, doubled on each further retry
+BACKOFF_MAX = 120  # Upper bound of the backoff delay in seconds
+TIMEOUT = (10, 300)  # Connect and read timeouts in seconds
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+# Delay before retry number `attempt` (0-based): the server's Retry-After if it sent one, otherwise
+# an exponential backoff with jitter, so that concurrent workers do not retry in lockstep
+def backoff_delay(attempt, response=None):
+    if response is not None and 'Retry-After' in response.headers:
+        try:
+            return float(response.headers['Retry-After'])
+        except ValueError:
+            pass  # An HTTP date instead of seconds, fall back to the backoff
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+# Thread-safe HTTP client on one pooled requests.Session. Connections are kept alive and reused
+# across requests, responses are gzip-compressed, each host has its own concurrency limit and
+# failed requests are retried with backoff. Requests, retries and latency are counted per host.
+class HttpClient:
+    def __init__(self, pool_size=POOL_SIZE, host_concurrency=HOST_CONCURRENCY, max_retries=MAX_RETRIES, timeout=TIMEOUT):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers['Accept-Encoding'] = 'gzip, deflate'
+        self.host_concurrency = dict(host_concurrency)
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.semaphores = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def _host(self, host):
+        # Semaphore and counters of a host, created on its first request
+        with self.lock:
+            if host not in self.semaphores:
+                self.semaphores[host] = threading.BoundedSemaphore(self.host_concurrency.get(host, DEFAULT_CONCURRENCY))
+                self.counters[host] = {'requests': 0, 'retries': 0, 'failures': 0, 'seconds': 0.0}
+            return self.semaphores[host], self.counters[host]
+
+    def _count(self, counters, **increments):
+        with self.lock:
+            for name, value in increments.items():
+                counters[name] += value
+
+    # Send a request, retrying connection errors and retry_statuses. rate_limiter is an optional
+    # TokenBucket acquired before every attempt and paused for the backoff delay, so that a 429
+    # slows down every worker sharing it. Returns the last response, which may still carry an
+    # error status, or raises the last connection error once the retries are used up.
+    def request(self, method, url, rate_limiter=None, retry_statuses=RETRY_STATUSES, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        host = urlsplit(url).netloc
+        semaphore, counters = self._host(host)
+
+        for attempt in range(self.max_retries + 1):
+            if rate_limiter is not None:
+                rate_limiter.acquire()
+            response, error = None, None
+            with semaphore:
+                start = time.monotonic()
+                try:
+                    response = self.session.request(method, url, **kwargs)
+                except requests.exceptions.RequestException as err:
+                    error = err
+                self._count(counters, requests=1, seconds=time.monotonic() - start)
+
+            if response is not None and response.status_code not in retry_statuses:
+                return response
+            if attempt == self.max_retries:
+                break
+
+            delay = backoff_delay(attempt, response)
+            reason = error if response is None else f"status code {response.status_code}"
+            print(f"Request to {host} failed ({reason}), retrying in {delay:.1f} seconds... (Attempt {attempt + 1}/{self.max_retries})")
+            self._count(counters, retries=1)
+            if rate_limiter is not None:
+                rate_limiter.pause(delay)
+            else:
+                time.sleep(delay)
+
+        self._count(counters, failures=1)
+        if response is None:
+            raise error
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def stats(self):
+        with self.lock:
+            return {host: dict(counters) for host, counters in self.counters.items()}
+
+    def print_stats(self):
+        for host, counters in sorted(self.stats().items()):
+            mean_latency = counters['seconds'] / counters['requests'] if counters['requests'] else 0
+            print(f"{host}: {counters['requests']} requests, {counters['retries']} retries, "
+                  f"{counters['failures']} failures, mean latency {mean_latency:.2f} seconds")
+
+# Shared by all fetchers of a process, so that they reuse one connection pool
+client = HttpClient()
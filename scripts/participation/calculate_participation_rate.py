@@ -1,7 +1,6 @@
 import os
 import sys
 import pandas as pd
-import requests
 from datetime import datetime
 from tqdm import tqdm
 
@@ -9,6 +8,7 @@ from tqdm import tqdm
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from scripts.config import PROPOSALS_PATH, METRICS_PATH, COMBINED_TOKENS_PATH, COINGECKO_API_KEY
+from scripts.http_client import client
 
 # Function to fetch market data from CoinGecko
 def fetch_market_data(token_id, days='max'):
@@ -17,7 +17,7 @@ def fetch_market_data(token_id, days='max'):
         'accept': 'application/json',
         'x-cg-pro-api-key': COINGECKO_API_KEY
     }
-    response = requests.get(url, headers=headers)
+    response = client.get(url, headers=headers)
     if response.status_code == 200:
         return response.json()
     else:
@@ -31,7 +31,7 @@ def fetch_historical_market_data(token_id, date):
         'accept': 'application/json',
         'x-cg-pro-api-key': COINGECKO_API_KEY
     }
-    response = requests.get(url, headers=headers)
+    response = client.get(url, headers=headers)
     if response.status_code == 200:
         return response.json()
     else:
@@ -162,4 +162,5 @@ total_proposals = len(proposals_df)
 successful_proposals = len(output_df)
 print(f"Total proposals: {total_proposals}")
 print(f"Successful proposals with market data: {successful_proposals}")
-print(f"Missing proposals after retry: {len(still_missing_proposals)}")
\ No newline at end of file
+print(f"Missing proposals after retry: {len(still_missing_proposals)}")
+client.print_stats()
\ No newline at end of file
@@ -7,10 +7,11 @@ import numpy as np
 # Ensure the root directory is in the sys.path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from scripts.config import PROPOSALS_VOTES_PATH, TOKEN_METRICS_PATH, METRICS_PATH
+from scripts.config import TOKEN_METRICS_PATH, METRICS_PATH
+from scripts.participation.vote_store import load_votes
 
 # Read proposal votes and details files
-votes_df = pd.read_csv(PROPOSALS_VOTES_PATH)
+votes_df = load_votes()
 token_holders_df = pd.read_csv(TOKEN_METRICS_PATH)
 
 print(f"Loaded votes file with {len(votes_df)} entries.")
@@ -38,20 +39,13 @@ def get_approx_unique_holders(date, token_id):
     approx_holders = before['unique_holders'] + (delta_holders / delta_days) * delta_date
     return approx_holders
 
-# Extract proposal ID from the nested dictionary in votes_df
-votes_df['proposal_id'] = votes_df['proposal'].apply(lambda x: eval(x)['id'])
-
 # Initialize a list to store results
 results = []
 
-# Get the unique proposal IDs from the votes DataFrame
-unique_proposals = votes_df['proposal_id'].unique()
-
 # Calculate voter turnout rate for each proposal
-for proposal_id in unique_proposals:
+for proposal_id, proposal_votes in votes_df.groupby('proposal_id', sort=False):
     try:
         print(f"Processing proposal_id: {proposal_id}")
-        proposal_votes = votes_df[votes_df['proposal_id'] == proposal_id]
         
         # Assuming 'end' and 'id' (token ID) can be retrieved similarly, adjust if necessary
         end_date = datetime.utcfromtimestamp(proposal_votes['created'].max()).strftime('%Y-%m-%d')
@@ -1,94 +1,117 @@
 import os
 import sys
+import argparse
 import requests
 import pandas as pd
-import time
 
 # Ensure the root directory is in the sys.path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from scripts.config import PROPOSALS_PATH
+from scripts.config import PROPOSALS_PATH, PROPOSALS_DETAILS_PATH
+from scripts.http_client import client
+from scripts.participation.sync_state import OPEN_STATES, upsert_csv
+
+# get_proposals.py already writes proposal_details.csv from its page query. This script only
+# rebuilds it for an existing proposals.csv, fetching the details of many proposals per request.
 
 # Constants
 SNAPSHOT_API_URL = "https://hub.snapshot.org/graphql"
-DELAY = 2  # Delay in seconds
+BATCH_SIZE = 100  # Proposal ids per request, the most Snapshot returns in one page
 
 # Read the proposals file
 proposals_file = os.path.join(PROPOSALS_PATH, "proposals.csv")
 proposals_df = pd.read_csv(proposals_file)
 print(f"Loaded proposals file with {len(proposals_df)} entries.")
 
-# Query template for detailed proposal information
-query_template = """
-{{
-  proposal(id: "{proposal_id}") {{
+# Query for detailed information on a batch of proposals
+query = """
+query ProposalDetails($ids: [String]!, $first: Int!) {
+  proposals(first: $first, where: {id_in: $ids}) {
     id
     title
     start
     end
     state
     author
-    space {{
+    space {
       id
       name
-    }}
+    }
     choices
     scores
     scores_total
     votes
-  }}
-}}
+    created
+  }
+}
 """
 
-def fetch_proposal_details(proposal_id):
-    query = query_template.format(proposal_id=proposal_id)
-    response = requests.post(SNAPSHOT_API_URL, json={'query': query})
-    
+def fetch_proposal_details(proposal_ids):
+    try:
+        response = client.post(SNAPSHOT_API_URL, json={'query': query, 'variables': {'ids': proposal_ids, 'first': len(proposal_ids)}})
+    except requests.exceptions.RequestException as err:
+        print(f"Request error for {len(proposal_ids)} proposals: {err}")
+        return None
+
     if response.status_code != 200:
-        print(f"Request failed with status code {response.status_code} for proposal: {proposal_id}")
+        print(f"Request failed with status code {response.status_code} for {len(proposal_ids)} proposals")
         print("Response:", response.text)
         return None
 
     try:
         data = response.json()
-        if 'data' in data and 'proposal' in data['data']:
-            return data['data']['proposal']
+        if 'data' in data and data['data'].get('proposals') is not None:
+            return data['data']['proposals']
         else:
-            print(f"No details found for proposal: {proposal_id}")
+            print(f"No details found for {len(proposal_ids)} proposals")
             print("Response:", data)
             return None
     except ValueError:
-        print(f"Error decoding JSON response for proposal: {proposal_id}")
+        print(f"Error decoding JSON response for {len(proposal_ids)} proposals")
         print("Response:", response.text)
         return None
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Rebuild proposal_details.csv from proposals.csv.")
+    parser.add_argument('--sync', action='store_true',
+                        help="Only fetch proposals missing from proposal_details.csv or still open, and upsert them")
+    return parser.parse_args()
+
 def main():
+    args = parse_args()
     detailed_proposals = []
-    
-    for _, row in proposals_df.iterrows():
-        proposal_id = row['proposal_id']
-        token_id = row['id']  # Fetch the token_id from the row
-        print(f"Fetching details for proposal: {proposal_id}")
-        proposal_details = fetch_proposal_details(proposal_id)
-        
+    token_ids = dict(zip(proposals_df['proposal_id'], proposals_df['id']))
+    proposal_ids = list(token_ids)
+    if args.sync and os.path.exists(PROPOSALS_DETAILS_PATH):
+        stored = set(pd.read_csv(PROPOSALS_DETAILS_PATH, usecols=['id'])['id'])
+        is_open = dict(zip(proposals_df['proposal_id'], proposals_df['state'].isin(OPEN_STATES)))
+        proposal_ids = [proposal_id for proposal_id in proposal_ids if proposal_id not in stored or is_open[proposal_id]]
+
+    for start in range(0, len(proposal_ids), BATCH_SIZE):
+        batch = proposal_ids[start:start + BATCH_SIZE]
+        print(f"Fetching details for proposals {start + 1}-{start + len(batch)} of {len(proposal_ids)}")
+        proposal_details = fetch_proposal_details(batch)
+
         if proposal_details:
-            # Add the token_id to the proposal details
-            proposal_details['token_id'] = token_id
-            detailed_proposals.append(proposal_details)
-        
-        # Delay to avoid hitting the API rate limit
-        time.sleep(DELAY)
-    
+            # Add the token_id to the proposal details, in the order of proposals.csv
+            by_id = {proposal['id']: proposal for proposal in proposal_details}
+            for proposal_id in batch:
+                if proposal_id in by_id:
+                    detailed_proposals.append({**by_id[proposal_id], 'token_id': token_ids[proposal_id]})
+
     details_df = pd.DataFrame(detailed_proposals)
-    
+
     # Ensure the directory exists
     os.makedirs(PROPOSALS_PATH, exist_ok=True)
-    
-    output_file = os.path.join(PROPOSALS_PATH, "proposal_details.csv")
-    details_df.to_csv(output_file, index=False)
-    
-    print(f"Saved detailed proposals to {output_file}")
+
+    if args.sync:
+        details_df = upsert_csv(PROPOSALS_DETAILS_PATH, details_df, key='id')
+    else:
+        details_df.to_csv(PROPOSALS_DETAILS_PATH, index=False)
+
+    print(f"Saved detailed proposals to {PROPOSALS_DETAILS_PATH}")
     print(f"Total proposals fetched: {len(detailed_proposals)}")
+    client.print_stats()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,84 +1,166 @@
 import os
 import sys
+import argparse
 import requests
 import pandas as pd
 
 # Ensure the root directory is in the sys.path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from scripts.config import SPACES_CSV_PATH, PROPOSALS_PATH
+from scripts.config import SPACES_CSV_PATH, PROPOSALS_PATH, PROPOSALS_DETAILS_PATH
+from scripts.http_client import client
+from scripts.participation.sync_state import OPEN_STATES, load_sync_state, save_sync_state, upsert_csv
 
 # Constants
 SNAPSHOT_API_URL = "https://hub.snapshot.org/graphql"
+BATCH_SIZE = 100  # Maximum number of open proposals refreshed per request
 
 # Read the spaces file
 spaces_df = pd.read_csv(SPACES_CSV_PATH)
 print(f"Loaded spaces file with {len(spaces_df)} entries.")
 
-# Query template to fetch proposals
-query_template = """
-{{
-  proposals(first: 100, skip: {skip}, where: {{space: "{space_id}"}}, orderBy: "created", orderDirection: desc) {{
+# Query template to fetch proposals, with every field of proposal_details.csv so that no
+# per-proposal detail request is needed. Only proposals created after `since` are returned.
+PROPOSAL_FIELDS = """
     id
     title
     start
     end
     state
     author
-    space {{
+    space {
       id
       name
-    }}
+    }
+    choices
     scores
     scores_total
     votes
+    created
+"""
+query_template = """
+{{
+  proposals(first: 100, skip: {skip}, where: {{space: "{space_id}", created_gt: {since}}}, orderBy: "created", orderDirection: desc) {{
+""" + PROPOSAL_FIELDS.replace('{', '{{').replace('}', '}}') + """
   }}
 }}
 """
 
-def fetch_proposals(space_id):
+# Query to refresh proposals that were still open at the last sync
+open_proposals_query = """
+query Proposals($ids: [String]!, $first: Int!) {
+  proposals(first: $first, where: {id_in: $ids}) {
+""" + PROPOSAL_FIELDS + """
+  }
+}
+"""
+
+# Proposals of a space created after since, newest first, and whether every page was fetched.
+# After a failed page only the newest proposals are known, so the caller must not move its
+# high-water mark past the missing ones.
+def fetch_proposals(space_id, since=0):
     proposals = []
     skip = 0
     
     while True:
-        query = query_template.format(space_id=space_id, skip=skip)
-        response = requests.post(SNAPSHOT_API_URL, json={'query': query})
+        query = query_template.format(space_id=space_id, skip=skip, since=since)
+        try:
+            response = client.post(SNAPSHOT_API_URL, json={'query': query})
+        except requests.exceptions.RequestException as err:
+            print(f"Request error for space {space_id}: {err}")
+            return proposals, False
         
         if response.status_code != 200:
             print(f"Request failed with status code {response.status_code} for space: {space_id}")
             print("Response:", response.text)
-            break
+            return proposals, False
 
         try:
             data = response.json()
             if 'data' in data and 'proposals' in data['data']:
                 new_proposals = data['data']['proposals']
                 if not new_proposals:
-                    break
+                    return proposals, True
                 proposals.extend(new_proposals)
                 skip += len(new_proposals)
             else:
                 print(f"No proposals found for space: {space_id}")
                 print("Response:", data)
-                break
+                return proposals, False
         except ValueError:
             print(f"Error decoding JSON response for space: {space_id}")
             print("Response:", response.text)
-            break
+            return proposals, False
+
+def fetch_proposals_by_id(proposal_ids):
+    proposals = []
+    for start in range(0, len(proposal_ids), BATCH_SIZE):
+        batch = proposal_ids[start:start + BATCH_SIZE]
+        variables = {'ids': batch, 'first': len(batch)}
+        try:
+            response = client.post(SNAPSHOT_API_URL, json={'query': open_proposals_query, 'variables': variables})
+        except requests.exceptions.RequestException as err:
+            # The batch's proposals are missing from the result, so main() keeps them open for the next sync
+            print(f"Request error for {len(batch)} open proposals: {err}")
+            continue
+
+        if response.status_code != 200:
+            print(f"Request failed with status code {response.status_code} for {len(batch)} open proposals")
+            print("Response:", response.text)
+            continue
+
+        try:
+            data = response.json()
+            if 'data' in data and data['data'].get('proposals') is not None:
+                proposals.extend(data['data']['proposals'])
+            else:
+                print("No open proposals found. Response:", data)
+        except ValueError:
+            print("Error decoding JSON response for open proposals")
+            print("Response:", response.text)
 
     return proposals
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Fetch the proposals of every Snapshot space.")
+    parser.add_argument('--sync', action='store_true',
+                        help="Only fetch proposals created since the last run and those still open, and upsert them into the stored tables")
+    return parser.parse_args()
+
 def main():
+    args = parse_args()
+    # A full crawl also records the sync state, so that later runs can sync from it
+    state = load_sync_state()
+    if not args.sync:
+        state['spaces'], state['open_proposals'] = {}, {}
+    previously_open = state['open_proposals']
+    open_proposals = {}
+
     all_proposals = []
+    detailed_proposals = []
     
     for _, row in spaces_df.iterrows():
         space_id = row['space_id']
         token_id = row['id']
         if pd.notna(space_id):  # Only process if space_id is not NaN
-            print(f"Fetching proposals for space: {space_id}")
-            proposals = fetch_proposals(space_id)
+            since = state['spaces'].get(space_id, 0)
+            print(f"Fetching proposals for space: {space_id}" + (f" created after {since}" if since else ""))
+            proposals, complete = fetch_proposals(space_id, since)
             print(f"Found {len(proposals)} proposals for space: {space_id}")
-            
+            if not complete:
+                print(f"Proposals of space {space_id} are incomplete, keeping its high-water mark at {since}")
+
+            # Proposals that were open at the last sync may have changed state, scores or votes since
+            fetched = {proposal['id'] for proposal in proposals}
+            reopen = [proposal_id for proposal_id, space in previously_open.items() if space == space_id and proposal_id not in fetched]
+            if reopen:
+                refreshed = fetch_proposals_by_id(reopen)
+                print(f"Refreshed {len(refreshed)} of {len(reopen)} open proposals for space: {space_id}")
+                # Keep proposals that could not be refreshed open, so the next sync retries them
+                missing = set(reopen) - {proposal['id'] for proposal in refreshed}
+                open_proposals.update((proposal_id, space_id) for proposal_id in missing)
+                proposals = proposals + refreshed
+
             for proposal in proposals:
                 proposal_data = {
                     'id': token_id,
@@ -95,16 +177,34 @@ def main():
                     'votes': proposal['votes']
                 }
                 all_proposals.append(proposal_data)
+                detailed_proposals.append({**proposal, 'token_id': token_id})
+                if proposal['state'] in OPEN_STATES:
+                    open_proposals[proposal['id']] = space_id
+                if complete:
+                    state['spaces'][space_id] = max(state['spaces'].get(space_id, 0), proposal['created'])
     
     proposals_df = pd.DataFrame(all_proposals)
+    details_df = pd.DataFrame(detailed_proposals)
     
     # Ensure the directory exists
     os.makedirs(PROPOSALS_PATH, exist_ok=True)
     
     output_file = os.path.join(PROPOSALS_PATH, "proposals.csv")
-    proposals_df.to_csv(output_file, index=False)
+    if args.sync:
+        proposals_df = upsert_csv(output_file, proposals_df, key='proposal_id')
+        details_df = upsert_csv(PROPOSALS_DETAILS_PATH, details_df, key='id')
+        print(f"Upserted {len(all_proposals)} new or open proposals, {len(proposals_df)} stored")
+    else:
+        proposals_df.to_csv(output_file, index=False)
+        details_df.to_csv(PROPOSALS_DETAILS_PATH, index=False)
     
     print(f"Saved all proposals to {output_file}")
+    print(f"Saved detailed proposals to {PROPOSALS_DETAILS_PATH}")
+
+    state['open_proposals'] = open_proposals
+    save_sync_state(state)
+    print(f"{len(open_proposals)} proposals are still open")
+    client.print_stats()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,113 +1,195 @@
 import os
 import sys
+import argparse
 import requests
 import pandas as pd
-import time
+from concurrent.futures import ThreadPoolExecutor
 
 # Ensure the root directory is in the sys.path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from scripts.config import PROPOSALS_PATH_CSV, PROPOSALS_VOTES_PATH
+from scripts.rate_limit import TokenBucket
+from scripts.http_client import client
+from scripts.participation.sync_state import load_sync_state, save_sync_state
+from scripts.participation.vote_store import LEGACY_VOTES_CSV_PATH, get_partition_path, import_legacy_votes, write_votes
 
 # Constants
 SNAPSHOT_API_URL = "https://hub.snapshot.org/graphql"
-DELAY = 2  # Delay in seconds
+PAGE_SIZE = 1000  # Maximum number of votes per request
+REQUESTS_PER_MINUTE = 60  # Snapshot hub limit for clients without an API key
+BURST_SIZE = 5  # Number of requests that may be sent back-to-back
+WORKERS = 4  # Number of proposals harvested concurrently
+MAX_CREATED = 2 ** 31 - 1  # Cursor before the first page, later than any vote
 
 # Read the proposal details file
 proposals_details_file = PROPOSALS_PATH_CSV
 proposals_df = pd.read_csv(proposals_details_file)
 print(f"Loaded proposal details file with {len(proposals_df)} entries.")
 
-# Query template for votes
-query_template = """
-{{
+# Query for one page of votes at or before a created cursor. Pages are keyed on created instead
+# of a growing skip, so large proposals are not cut off by Snapshot's skip limit and new votes
+# do not shift the pages. skip is only used when a full page shares one timestamp. since is
+# the lower bound of an incremental sync, inclusive so that votes cast in the same second as the
+# last stored one are not missed; they are deduplicated by id when stored.
+query = """
+query Votes($proposal: String!, $created: Int!, $since: Int!, $skip: Int!, $first: Int!) {
   votes (
-    first: 1000
-    skip: {skip}
-    where: {{
-      proposal: "{proposal_id}"
-    }}
+    first: $first
+    skip: $skip
+    where: {
+      proposal: $proposal
+      created_lte: $created
+      created_gte: $since
+    }
     orderBy: "created",
     orderDirection: desc
-  ) {{
+  ) {
     id
     voter
     vp
     vp_by_strategy
     vp_state
     created
-    proposal {{
+    proposal {
       id
-    }}
+    }
     choice
-    space {{
+    space {
       id
-    }}
-  }}
-}}
+    }
+  }
+}
 """
 
-def fetch_votes(proposal_id, skip=0):
-    query = query_template.format(proposal_id=proposal_id, skip=skip)
-    response = requests.post(SNAPSHOT_API_URL, json={'query': query})
-    
-    if response.status_code != 200:
-        print(f"Request failed with status code {response.status_code} for proposal: {proposal_id}")
-        print("Response:", response.text)
-        return None
+# Shared by all workers, so the request rate stays within the API limit however many run
+rate_limiter = TokenBucket(rate=REQUESTS_PER_MINUTE / 60, capacity=BURST_SIZE)
+
+# One page of votes, or None if it could not be fetched. The client retries failed requests, a 429
+# pauses the shared rate limiter and so slows every worker down.
+def fetch_votes(proposal_id, created=MAX_CREATED, skip=0, since=0):
+    variables = {'proposal': proposal_id, 'created': created, 'since': since, 'skip': skip, 'first': PAGE_SIZE}
 
     try:
+        response = client.post(SNAPSHOT_API_URL, json={'query': query, 'variables': variables}, rate_limiter=rate_limiter)
+        if response.status_code != 200:
+            print(f"Request failed with status code {response.status_code} for proposal: {proposal_id}")
+            print("Response:", response.text)
+            return None
         data = response.json()
-        if 'data' in data and 'votes' in data['data']:
+        if 'data' in data and data['data'].get('votes') is not None:
             return data['data']['votes']
-        else:
-            print(f"No votes found for proposal: {proposal_id}")
-            print("Response:", data)
-            return None
+        print(f"No votes found for proposal: {proposal_id}")
+        print("Response:", data)
     except ValueError:
         print(f"Error decoding JSON response for proposal: {proposal_id}")
-        print("Response:", response.text)
+    except requests.exceptions.RequestException as err:
+        print(f"Request error for proposal {proposal_id}: {err}")
+
+    return None
+
+# All votes of a proposal created at or after since, newest first and deduplicated by vote id.
+# Returns None if a page could not be fetched.
+def harvest_votes(proposal_id, since=0):
+    votes = {}
+    created, skip = MAX_CREATED, 0
+    while True:
+        page = fetch_votes(proposal_id, created, skip, since)
+        if page is None:
+            return None
+        for vote in page:
+            votes.setdefault(vote['id'], vote)
+        if len(page) < PAGE_SIZE:
+            return list(votes.values())
+
+        if page[0]['created'] == page[-1]['created']:
+            # The whole page shares one timestamp, so the cursor cannot move; step over it with skip,
+            # which relies on Snapshot returning tied votes in the same order
+            skip += len(page)
+        else:
+            # Continue at the oldest timestamp of the page. Its votes come first on the next page
+            # whatever order tied votes are returned in, and are deduplicated by id.
+            skip = 0
+        created = page[-1]['created']
+
+# Harvest the votes of a proposal and write them to its partition straight away, so only the
+# proposals in flight are held in memory. Returns the number of votes and the latest created, or
+# None if the votes could not be fetched or written.
+def fetch_proposal_votes(row):
+    proposal_id, space_id, token_id, since = row
+    print(f"Fetching votes for proposal: {proposal_id}" + (f" created since {since}" if since else ""))
+    try:
+        votes = harvest_votes(proposal_id, since)
+        if votes is None:
+            print(f"Giving up on proposal {proposal_id}")
+            return None
+
+        # Incremental harvests are merged into the stored votes, full ones replace them
+        write_votes(space_id, proposal_id, token_id, votes, merge=bool(since))
+    except Exception as err:
+        # Any error is confined to its proposal, so the other workers' results still reach the sync state
+        print(f"Error harvesting proposal {proposal_id}: {err!r}")
         return None
+    print(f"Fetched {len(votes)} votes for proposal: {proposal_id}")
+    return len(votes), max((vote['created'] for vote in votes), default=since)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Fetch the votes of every proposal in proposals.csv.")
+    parser.add_argument('--sync', action='store_true',
+                        help="Only fetch new votes of proposals that were not closed at their last harvest, and upsert them")
+    return parser.parse_args()
 
 def main():
-    all_votes = []
-
-    for _, row in proposals_df.iterrows():
-        proposal_id = row['proposal_id']
-        token_id = row['id']  # Fetch the token_id (CoinGecko ID) from the row
-        print(f"Fetching votes for proposal: {proposal_id}")
-        
-        skip = 0
-        while True:
-            votes = fetch_votes(proposal_id, skip=skip)
-            if not votes:
-                break
-            
-            # Add the CoinGecko ID to each vote
-            for vote in votes:
-                vote['token_id'] = token_id
-
-            all_votes.extend(votes)
-            skip += len(votes)
-            time.sleep(DELAY)  # Add delay between each API call
-            if len(votes) < 1000:
-                break
-        time.sleep(DELAY)  # Add delay between fetching votes for different proposals
-    
-    if not all_votes:
-        print("No votes fetched. Please check the proposal IDs and API query.")
-        return
-
-    votes_df = pd.DataFrame(all_votes)
-    
-    # Ensure the directory exists
-    os.makedirs(os.path.dirname(PROPOSALS_VOTES_PATH), exist_ok=True)
-    
-    # Save the votes to the CSV file directly
-    votes_df.to_csv(PROPOSALS_VOTES_PATH, index=False)
-    
-    print(f"Saved votes details to {PROPOSALS_VOTES_PATH}")
-    print(f"Total votes fetched: {len(votes_df)}")
+    args = parse_args()
+    # A full crawl also records the sync state, so that later runs can sync from it
+    state = load_sync_state()
+    if not args.sync:
+        state['votes'] = {}
+    elif os.path.exists(LEGACY_VOTES_CSV_PATH):
+        # Votes of a crawl from before the partitions; only votes cast since are fetched for them
+        imported = import_legacy_votes()
+        for proposal_id, created in imported.items():
+            state['votes'].setdefault(proposal_id, {'created': created, 'closed': False})
+        print(f"Imported the votes of {len(imported)} proposals from {LEGACY_VOTES_CSV_PATH}")
+
+    total_votes = 0
+    failed = []
+
+    # token_id is the CoinGecko ID of the proposal's space. Proposals harvested after they closed
+    # cannot receive votes any more and are skipped, unless their partition has gone missing.
+    rows = []
+    closed = {}
+    for proposal_id, space_id, token_id, proposal_state in zip(proposals_df['proposal_id'], proposals_df['space_id'],
+                                                               proposals_df['id'], proposals_df['state']):
+        harvested = state['votes'].get(proposal_id)
+        if harvested and not os.path.exists(get_partition_path(space_id, proposal_id)):
+            harvested = None
+        if harvested and harvested['closed']:
+            continue
+        rows.append((proposal_id, space_id, token_id, harvested['created'] if harvested else 0))
+        closed[proposal_id] = proposal_state == 'closed'
+    if args.sync:
+        print(f"Syncing votes of {len(rows)} of {len(proposals_df)} proposals")
+
+    # The state is saved even if the run is interrupted, so the proposals harvested so far are not fetched again
+    try:
+        with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+            # map() keeps the order of the proposals file, so the output is deterministic
+            for (proposal_id, *_), result in zip(rows, executor.map(fetch_proposal_votes, rows)):
+                if result is None:
+                    failed.append(proposal_id)
+                    continue
+                count, latest = result
+                total_votes += count
+                state['votes'][proposal_id] = {'created': latest, 'closed': closed[proposal_id]}
+    finally:
+        save_sync_state(state)
+
+    print(f"Saved votes to {PROPOSALS_VOTES_PATH}")
+    print(f"Total votes fetched: {total_votes}")
+    if failed:
+        print(f"{len(failed)} proposals could not be fetched: {', '.join(failed)}")
+    client.print_stats()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,40 @@
+import os
+import sys
+import json
+import pandas as pd
+
+# Ensure the root directory is in the sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scripts.config import SYNC_STATE_PATH
+
+# State of the incremental Snapshot sync (--sync in get_proposals.py and get_votes.py):
+#   spaces:         space id -> latest proposal `created` seen (high-water mark)
+#   open_proposals: proposal id -> space id, for proposals still active or pending
+#   votes:          proposal id -> {'created': latest vote `created` stored,
+#                                   'closed': whether the proposal was closed when harvested}
+OPEN_STATES = ('active', 'pending')
+
+def load_sync_state():
+    state = {'spaces': {}, 'open_proposals': {}, 'votes': {}}
+    if os.path.exists(SYNC_STATE_PATH):
+        with open(SYNC_STATE_PATH) as f:
+            state.update(json.load(f))
+    return state
+
+def save_sync_state(state):
+    os.makedirs(os.path.dirname(SYNC_STATE_PATH), exist_ok=True)
+    tmp_path = SYNC_STATE_PATH + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, SYNC_STATE_PATH)
+
+# Merge new rows into a stored CSV table, new rows replacing stored rows with the same key
+def upsert_csv(path, new_df, key):
+    if os.path.exists(path) and not new_df.empty:
+        new_df = pd.concat([pd.read_csv(path), new_df], ignore_index=True).drop_duplicates(subset=key, keep='last')
+    elif os.path.exists(path):
+        new_df = pd.read_csv(path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    new_df.to_csv(path, index=False)
+    return new_df
@@ -0,0 +1,137 @@
+import os
+import sys
+import ast
+import json
+import numpy as np
+import pandas as pd
+
+# Ensure the root directory is in the sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scripts.config import PROPOSALS_PATH, PROPOSALS_VOTES_PATH
+from scripts.decentralization.holder_store import load_snapshot, save_snapshot
+
+# Votes are stored as one uncompressed .npz partition per proposal, at
+# PROPOSALS_VOTES_PATH/<space_id>/<proposal_id>.npz, with the typed columns
+#   id, voter, vp_state: strings
+#   vp:                  voting power (float64, NaN if missing)
+#   created:             unix timestamp (int64)
+#   choice:              the choice as JSON text, since it is an int, list or dict depending on the voting type
+#   vp_by_strategy:      voting power per strategy, all votes' lists concatenated (float64),
+#                        the list of row i being vp_by_strategy[vp_by_strategy_offsets[i]:vp_by_strategy_offsets[i + 1]]
+# and the scalars proposal_id, space_id and token_id, which readers repeat for every row.
+# Rows are sorted by created, newest first.
+VOTES_EXTENSION = ".npz"
+ROW_COLUMNS = ('id', 'voter', 'vp', 'vp_state', 'created', 'choice')
+PARTITION_FIELDS = ('proposal_id', 'space_id', 'token_id')
+LEGACY_VOTES_CSV_PATH = os.path.join(PROPOSALS_PATH, "proposal_votes.csv")  # Single-file layout written before the partitions
+LEGACY_CHUNK_ROWS = 200000  # Rows of the legacy CSV parsed at a time
+
+def get_partition_path(space_id, proposal_id):
+    return os.path.join(PROPOSALS_VOTES_PATH, space_id, proposal_id + VOTES_EXTENSION)
+
+def votes_to_columns(votes):
+    strategies = [vote.get('vp_by_strategy') or [] for vote in votes]
+    return {
+        'id': np.array([vote['id'] for vote in votes], dtype=str),
+        'voter': np.array([vote['voter'] for vote in votes], dtype=str),
+        'vp': np.array([np.nan if vote.get('vp') is None else vote['vp'] for vote in votes], dtype=float),
+        'vp_state': np.array([vote.get('vp_state') or '' for vote in votes], dtype=str),
+        'created': np.array([vote['created'] for vote in votes], dtype=np.int64),
+        'choice': np.array([json.dumps(vote.get('choice')) for vote in votes], dtype=str),
+        'vp_by_strategy': np.array([vp for vp_list in strategies for vp in vp_list], dtype=float),
+        'vp_by_strategy_offsets': np.concatenate([[0], np.cumsum([len(vp_list) for vp_list in strategies])]).astype(np.int64),
+    }
+
+# Select rows of a partition, carrying the ragged vp_by_strategy lists along
+def take_rows(columns, rows):
+    offsets = columns['vp_by_strategy_offsets']
+    lengths = np.diff(offsets)[rows]
+    new_offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+    value_index = np.repeat(offsets[:-1][rows] - new_offsets[:-1], lengths) + np.arange(new_offsets[-1])
+    taken = {name: columns[name][rows] for name in ROW_COLUMNS}
+    taken['vp_by_strategy'] = columns['vp_by_strategy'][value_index]
+    taken['vp_by_strategy_offsets'] = new_offsets
+    return taken
+
+# Merge new votes into stored ones, a new vote replacing a stored vote with the same id
+def merge_columns(stored, new):
+    merged = {name: np.concatenate([stored[name], new[name]]) for name in ROW_COLUMNS + ('vp_by_strategy',)}
+    merged['vp_by_strategy_offsets'] = np.concatenate([stored['vp_by_strategy_offsets'],
+                                                       new['vp_by_strategy_offsets'][1:] + stored['vp_by_strategy_offsets'][-1]])
+    # Last occurrence of each id, found as the first occurrence in the reversed ids
+    _, last = np.unique(merged['id'][::-1], return_index=True)
+    keep = len(merged['id']) - 1 - last
+    return take_rows(merged, keep[np.argsort(-merged['created'][keep], kind='stable')])
+
+# Write the votes of one proposal to its partition. With merge, the votes are added to the stored
+# partition instead of replacing it.
+def write_votes(space_id, proposal_id, token_id, votes, merge=False):
+    path = get_partition_path(space_id, proposal_id)
+    columns = votes_to_columns(votes)
+    if merge and os.path.exists(path):
+        columns = merge_columns(load_snapshot(path), columns)
+    save_snapshot(path, proposal_id=np.array(proposal_id), space_id=np.array(space_id),
+                  token_id=np.array(token_id), **columns)
+    return path
+
+# Map (space_id, proposal_id) -> partition path, optionally only for the given spaces or proposals
+def list_vote_partitions(space_ids=None, proposal_ids=None):
+    partitions = {}
+    if not os.path.isdir(PROPOSALS_VOTES_PATH):
+        return partitions
+    proposal_ids = None if proposal_ids is None else set(proposal_ids)
+    for space_id in sorted(os.listdir(PROPOSALS_VOTES_PATH)):
+        space_path = os.path.join(PROPOSALS_VOTES_PATH, space_id)
+        if not os.path.isdir(space_path) or (space_ids is not None and space_id not in space_ids):
+            continue
+        for filename in sorted(os.listdir(space_path)):
+            proposal_id, extension = os.path.splitext(filename)
+            if extension == VOTES_EXTENSION and (proposal_ids is None or proposal_id in proposal_ids):
+                partitions[(space_id, proposal_id)] = os.path.join(space_path, filename)
+    return partitions
+
+# Load the votes of the given spaces or proposals (all by default) as one DataFrame with flat
+# proposal_id, space_id and token_id columns. vp_by_strategy lists are only built when asked for.
+def load_votes(space_ids=None, proposal_ids=None, vp_by_strategy=False):
+    frames = []
+    for path in list_vote_partitions(space_ids, proposal_ids).values():
+        partition = load_snapshot(path)
+        rows = len(partition['id'])
+        frame = {name: np.repeat(partition[name], rows) for name in PARTITION_FIELDS}
+        frame.update((name, partition[name]) for name in ROW_COLUMNS)
+        if vp_by_strategy:
+            frame['vp_by_strategy'] = np.split(partition['vp_by_strategy'], partition['vp_by_strategy_offsets'][1:-1]) if rows else []
+        frames.append(pd.DataFrame(frame))
+    if not frames:
+        return pd.DataFrame(columns=list(PARTITION_FIELDS + ROW_COLUMNS) + (['vp_by_strategy'] if vp_by_strategy else []))
+    return pd.concat(frames, ignore_index=True)
+
+# One-time import of the legacy proposal_votes.csv, whose proposal, space, vp_by_strategy and choice
+# columns hold Python reprs, into partitions. The file is read in chunks and every chunk is merged
+# into the partitions, then renamed to .imported. Returns the latest created per imported proposal.
+def import_legacy_votes(path=LEGACY_VOTES_CSV_PATH):
+    latest = {}
+    for chunk in pd.read_csv(path, dtype=str, keep_default_na=False, chunksize=LEGACY_CHUNK_ROWS):
+        votes = [{
+            'id': row['id'],
+            'voter': row['voter'],
+            'vp': float(row['vp']) if row['vp'] else None,
+            'vp_by_strategy': ast.literal_eval(row['vp_by_strategy']) if row['vp_by_strategy'] else [],
+            'vp_state': row['vp_state'],
+            'created': int(row['created']),
+            'choice': ast.literal_eval(row['choice']) if row['choice'] else None,
+            'proposal_id': ast.literal_eval(row['proposal'])['id'],
+            'space_id': ast.literal_eval(row['space'])['id'],
+            'token_id': row['token_id'],
+        } for row in chunk.to_dict('records')]
+
+        by_proposal = {}
+        for vote in votes:
+            by_proposal.setdefault((vote['space_id'], vote['proposal_id'], vote['token_id']), []).append(vote)
+        for (space_id, proposal_id, token_id), proposal_votes in by_proposal.items():
+            write_votes(space_id, proposal_id, token_id, proposal_votes, merge=True)
+            latest[proposal_id] = max(latest.get(proposal_id, 0), max(vote['created'] for vote in proposal_votes))
+
+    os.replace(path, path + ".imported")
+    return latest
@@ -13,7 +13,10 @@ def main():
     # Data Collection, Processing of Token Holders (based on data/processed/consolidated_index.csv)
     os.system('python scripts/decentralization/fetch_token_holders.py') # collects data from bitquery, token holders
     os.system('python scripts/decentralization/process_token_holders.py') # processes data, filters exchange addresses
-    os.system('python scripts/decentralization/calculate_metrics.py') # analyzes and processes data, calculates metrics
+    os.system('python scripts/decentralization/detect_exchange_addresses.py') # scores likely exchange/contract addresses, use with process_token_holders.py --candidate-min-score (candidates take effect on the next run)
+    os.system(f'python scripts/decentralization/calculate_metrics.py --workers {os.cpu_count()}') # analyzes and processes data, calculates metrics
+    os.system('python scripts/decentralization/calculate_churn.py') # compares consecutive snapshots, holder churn
+    os.system('python scripts/decentralization/calculate_holder_overlap.py') # estimates holder overlap between tokens
 
     # Data Visualization
     os.system('python scripts/decentralization/plot_metrics.py') # plots data, saves to file
@@ -23,9 +26,8 @@ def main():
 
     ### Participation Metrics
     # Data Collection
-    os.system('python scripts/participation/get_proposals.py') # fetches proposals from snapshot
-    os.system('python scripts/participation/get_proposal_details.py') # fetches proposal details from snapshot
-    os.system('python scripts/participation/get_votes.py') # fetches proposal votes from snapshot
+    os.system('python scripts/participation/get_proposals.py --sync') # fetches new and open proposals and their details from snapshot
+    os.system('python scripts/participation/get_votes.py --sync') # fetches new votes of open proposals from snapshot, all votes on the first run
 
     # Data Processing
     os.system('python scripts/participation/calculate_cumulative_proposals.py') # calculates metrics of tokens